@@ -1,65 +1,387 @@
-import ollama
+import asyncio
+import hashlib
+import random
 import re
-import statistics
+import time
+import uuid
 from datetime import datetime
-from collections import defaultdict
 from config import (
-    MODEL_NAME, FOCUS_PROMPTS, BRAND_MULTIPLIERS, CONDITION_MULTIPLIERS, 
-    SEGMENT_BASE_PRICES
+    MODEL_NAME, MODEL_KEEP_ALIVE, MAX_CONCURRENT_ANALYSES, IMAGES_PER_MODEL_CALL,
+    MODEL_CALL_RETRIES, MODEL_RETRY_BACKOFF_SECONDS, REQUEST_DEADLINE_SECONDS,
+    ADAPTIVE_WAVE_SIZE, ADAPTIVE_CONFIDENCE_THRESHOLD, ADAPTIVE_MIN_AGREEMENT, ADAPTIVE_STABLE_FIELDS
 )
+from models import ImageAnalysisResult
+from cache import analysis_cache, image_digest, make_cache_key
+from scheduler import model_scheduler, QueueFullError, ModelTimeoutError
+from model_client import is_backend_failure
+from metrics import stage, record_model_response, ANALYSIS_ERRORS, MODEL_RETRIES, DEADLINES_EXCEEDED
+from config_snapshot import current_snapshot
+from consolidation import ConsolidationAccumulator
 from utils import (
-    parse_characteristics, calculate_confidence_score, get_most_common_value,
+    parse_model_output, analysis_prompt, model_chat_options, calculate_confidence_score,
     get_positive_factors, get_negative_factors, get_price_recommendations
 )
 
-def analyze_single_car_image(image_data, image_name="", focus_area="general"):
-    """Analyze a single car image with specific focus"""
-    prompt = FOCUS_PROMPTS.get(focus_area, FOCUS_PROMPTS["general"])
+def build_analysis_messages(image_data, focus_area="general"):
+    """Build the chat messages for analyzing one image with a given focus"""
+    return [{
+        'role': 'user',
+        'content': analysis_prompt(focus_area),
+        # Uploads are read into a bytearray; the ollama client only takes bytes
+        'images': [bytes(image_data)]
+    }]
+
+class DeadlineExceededError(Exception):
+    """Raised when a request's deadline passes before its model call finished"""
+
+def request_deadline(seconds=REQUEST_DEADLINE_SECONDS):
+    """Monotonic time by which a request's model calls must be done, None for no deadline"""
+    return time.monotonic() + seconds if seconds else None
+
+def is_transient_error(error):
+    """Timeouts and backend errors, which may succeed when tried again"""
+    return isinstance(error, ModelTimeoutError) or is_backend_failure(error)
+
+async def submit_model_call(request_id, deadline=None, **chat_kwargs):
+    """Submit a model call, retrying transient errors with exponential backoff while the deadline allows"""
+    for attempt in range(MODEL_CALL_RETRIES + 1):
+        remaining = None if deadline is None else deadline - time.monotonic()
+        try:
+            if remaining is not None and remaining <= 0:
+                raise asyncio.TimeoutError
+            # Bounds the queue wait as well; the scheduler cancels the call if it already started
+            return await asyncio.wait_for(model_scheduler.submit(request_id, **chat_kwargs), remaining)
+        except asyncio.TimeoutError:
+            DEADLINES_EXCEEDED.inc()
+            raise DeadlineExceededError("Request deadline exceeded")
+        except Exception as e:
+            if attempt == MODEL_CALL_RETRIES or not is_transient_error(e):
+                raise
+            backoff = MODEL_RETRY_BACKOFF_SECONDS * 2 ** attempt * random.uniform(0.5, 1.5)
+            if deadline is not None and time.monotonic() + backoff >= deadline:
+                raise
+            MODEL_RETRIES.labels('timeout' if isinstance(e, ModelTimeoutError) else 'backend_error').inc()
+            await asyncio.sleep(backoff)
+
+async def analyze_car_image_async(image_data, image_name="", focus_area="general", request_id=None, digest=None,
+                                  deadline=None):
+    """Analyze raw image bytes through the shared model scheduler, serving repeated images from the cache"""
+    cache_key = make_cache_key(digest or image_digest(image_data), focus_area)
+    cached_analysis = await analysis_cache.get_async(cache_key)
+    if cached_analysis is not None:
+        return cached_analysis
+    if image_data is None:
+        # A known image the client did not upload, whose result left the cache after the lookup
+        raise Exception(f"Cached analysis of {image_name} is no longer available, upload the image again")
     
+    # Raw bytes go straight to the ollama client, which does the only base64 encoding
     try:
-        response = ollama.chat(
-            model=MODEL_NAME,
-            messages=[{
-                'role': 'user',
-                'content': prompt,
-                'images': [image_data]
-            }]
-        )
-        
-        return response['message']['content']
+        with stage('model'):
+            response = await submit_model_call(
+                request_id or uuid.uuid4().hex,
+                deadline,
+                model=MODEL_NAME,
+                messages=build_analysis_messages(image_data, focus_area),
+                **model_chat_options(focus_area)
+            )
+        record_model_response(response)
+        raw_analysis = response['message']['content']
+    except (QueueFullError, DeadlineExceededError, ModelTimeoutError):
+        raise
     except Exception as e:
+        ANALYSIS_ERRORS.labels(focus_area).inc()
         raise Exception(f"Failed to analyze image {image_name}: {str(e)}")
-
-def consolidate_multiple_analyses(analyses_results):
-    """Consolidate multiple image analyses into a single comprehensive result"""
-    all_characteristics = defaultdict(list)
-    confidence_scores = []
-    
-    # Collect all characteristics from all analyses
-    for result in analyses_results:
-        confidence_scores.append(result.confidence_score)
-        for key, value in result.characteristics.items():
-            if value not in ["Not specified", "Unknown", "Not visible", ""]:
-                all_characteristics[key].append(value)
     
-    # Consolidate characteristics using majority vote or best available info
-    consolidated = {}
-    for key, values in all_characteristics.items():
-        consolidated[key] = get_most_common_value(values)
+    await analysis_cache.set_async(cache_key, raw_analysis)
+    return raw_analysis
+
+FOCUS_AREA_HINTS = {
+    "general": "general view",
+    "exterior": "exterior close-up",
+    "interior": "interior",
+    "wheels": "wheels and tires",
+}
+
+_IMAGE_SECTION = re.compile(r'^[#*\s]*IMAGE[ _]*(\d+)\b[*:\s-]*', re.IGNORECASE | re.MULTILINE)
+
+def build_group_prompt(images):
+    """Combined prompt asking for one labelled section per image of the same car"""
+    listing = "\n".join(
+        f"    Image {i}: {FOCUS_AREA_HINTS.get(image.focus_area, 'general view')}"
+        for i, image in enumerate(images, start=1)
+    )
+    return f"""
+    You are given {len(images)} images of the same car, in this order:
+{listing}
     
-    # Fill in missing keys
-    all_keys = set()
-    for result in analyses_results:
-        all_keys.update(result.characteristics.keys())
+    For each image, write a section that starts with a line "IMAGE <number>:" and
+    then answers the following for that image:
+    {current_snapshot().focus_prompts["general"]}"""
+
+class GroupSection(str):
+    """One image's section of a grouped answer, tagged with the version of the group prompt"""
+
+    def __new__(cls, text, prompt_version):
+        section = super().__new__(cls, text)
+        section.prompt_version = prompt_version
+        return section
+
+def group_prompt_version(prompt):
+    """Short digest of a group prompt; group outputs are recorded under it, not the focus prompt's"""
+    return "group:" + hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:12]
+
+def split_group_analysis(analysis_text, image_count):
+    """Split a combined answer into per-image notes, one per image in order.
+
+    Images without their own section get the whole answer.
+    """
+    sections = {}
+    markers = list(_IMAGE_SECTION.finditer(analysis_text))
+    for marker, next_marker in zip(markers, markers[1:] + [None]):
+        number = int(marker.group(1))
+        end = next_marker.start() if next_marker else len(analysis_text)
+        if 1 <= number <= image_count and number not in sections:
+            sections[number] = analysis_text[marker.end():end].strip()
+    return [sections.get(i) or analysis_text for i in range(1, image_count + 1)]
+
+async def analyze_car_image_group_async(images, request_id=None, deadline=None):
+    """Analyze several images of one car in a single model call, returning per-image notes.
+
+    Grouped answers depend on the whole group, so they are not cached.
+    """
+    names = ", ".join(image.name for image in images)
+    prompt = build_group_prompt(images)
+    try:
+        with stage('model'):
+            response = await submit_model_call(
+                request_id or uuid.uuid4().hex,
+                deadline,
+                model=MODEL_NAME,
+                messages=[{
+                    'role': 'user',
+                    'content': prompt,
+                    'images': [bytes(image.data) for image in images]
+                }],
+                keep_alive=MODEL_KEEP_ALIVE
+            )
+        record_model_response(response)
+    except (QueueFullError, DeadlineExceededError, ModelTimeoutError):
+        raise
+    except Exception as e:
+        ANALYSIS_ERRORS.labels('group').inc()
+        raise Exception(f"Failed to analyze images {names}: {str(e)}")
+    version = group_prompt_version(prompt)
+    return [GroupSection(section, version) for section in split_group_analysis(response['message']['content'], len(images))]
+
+async def plan_model_calls(images, images_per_call):
+    """Group image indexes into model calls.
+
+    Cached images stay on their own so they are served from the cache; the
+    rest are packed images_per_call at a time.
+    """
+    if images_per_call <= 1:
+        return [[i] for i in range(len(images))]
     
-    for key in all_keys:
-        if key not in consolidated:
-            consolidated[key] = "Not determined"
+    keys = [make_cache_key(image.digest or image_digest(image.data), image.focus_area) for image in images]
+    found = await analysis_cache.peek_many_async(keys)
+    cached, misses = [], []
+    for i, image in enumerate(images):
+        # Known images without data are never packed, so an expired one fails on its own
+        (cached if image.data is None or keys[i] in found else misses).append(i)
+    return [[i] for i in cached] + [misses[j:j + images_per_call] for j in range(0, len(misses), images_per_call)]
+
+async def analyze_car_images_as_completed(images, request_id=None, max_concurrency=MAX_CONCURRENT_ANALYSES,
+                                          images_per_call=IMAGES_PER_MODEL_CALL, deadline=None):
+    """Analyze UploadedImage tuples concurrently.
+
+    Yields (index, raw_analysis) pairs as each image finishes. A failed image
+    yields its exception in place of the analysis text so it does not cancel
+    the other images; so does an image still unfinished at the deadline.
+    With images_per_call > 1, uncached images are packed into combined
+    model calls.
+    """
+    request_id = request_id or uuid.uuid4().hex
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run(indexes):
+        group = [images[i] for i in indexes]
+        async with semaphore:
+            try:
+                if len(group) == 1:
+                    image = group[0]
+                    raw_analyses = [await analyze_car_image_async(
+                        image.data, image.name, image.focus_area, request_id, image.digest, deadline
+                    )]
+                else:
+                    raw_analyses = await analyze_car_image_group_async(group, request_id, deadline)
+            except Exception as e:
+                raw_analyses = [e] * len(group)
+        return list(zip(indexes, raw_analyses))
+
+    tasks = [asyncio.create_task(run(indexes)) for indexes in await plan_model_calls(images, images_per_call)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            for result in await next_done:
+                yield result
+    finally:
+        # The consumer stopped early (e.g. a client disconnect); drop remaining work
+        for task in tasks:
+            task.cancel()
+
+async def analyze_car_images_concurrently(images, request_id=None, max_concurrency=MAX_CONCURRENT_ANALYSES,
+                                          images_per_call=IMAGES_PER_MODEL_CALL, deadline=None):
+    """Analyze UploadedImage tuples concurrently, returning results in input order"""
+    raw_analyses = [None] * len(images)
+    async for index, raw_analysis in analyze_car_images_as_completed(
+        images, request_id, max_concurrency, images_per_call, deadline
+    ):
+        raw_analyses[index] = raw_analysis
+    return raw_analyses
+
+def split_analyses(images, raw_analyses):
+    """Parse the images that were analyzed and keep the errors of the others.
+
+    Returns (analyzed images, their ImageAnalysisResults, [(image, exception)])
+    in upload order.
+    """
+    analyzed_images, individual_analyses, errors = [], [], []
+    for image, raw_analysis in zip(images, raw_analyses):
+        if isinstance(raw_analysis, Exception):
+            errors.append((image, raw_analysis))
+        else:
+            analyzed_images.append(image)
+            individual_analyses.append(build_image_result(image.name, raw_analysis))
+    return analyzed_images, individual_analyses, errors
+
+def adaptive_priority_order(images):
+    """Image indexes with general views first, then grouped by focus area"""
+    focus_order = list(current_snapshot().focus_prompts)
+    return sorted(
+        range(len(images)),
+        key=lambda i: focus_order.index(images[i].focus_area) if images[i].focus_area in focus_order else len(focus_order)
+    )
+
+def identification_is_stable(accumulator):
+    """Every stable field has an agreed majority and mean confidence passes the threshold"""
+    if not accumulator.images or accumulator.overall_confidence < ADAPTIVE_CONFIDENCE_THRESHOLD:
+        return False
+    return all(accumulator.has_stable_majority(field, ADAPTIVE_MIN_AGREEMENT) for field in ADAPTIVE_STABLE_FIELDS)
+
+async def analyze_car_images_adaptive(images, request_id=None, images_per_call=IMAGES_PER_MODEL_CALL, deadline=None):
+    """Analyze images in priority order and stop once the car is pinned down.
+
+    Images go to the model in small waves. After each wave the votes for the
+    stable fields are updated, and the loop stops when they agree, confidence
+    is high enough and every focus area present has been looked at once.
+    Failed images are left out of the votes. Returns (analyzed images, their
+    results, [(image, exception)], indexes of skipped images, the votes as a
+    ConsolidationAccumulator), in upload order.
+    """
+    request_id = request_id or uuid.uuid4().hex
+    wave_size = max(ADAPTIVE_WAVE_SIZE, images_per_call)
+    remaining = adaptive_priority_order(images)
+    uncovered_focus_areas = {image.focus_area for image in images}
+    accumulator = ConsolidationAccumulator()
+    results = {}
+    errors = {}
+
+    while remaining:
+        if identification_is_stable(accumulator):
+            if not uncovered_focus_areas:
+                break
+            # The car is identified, only look at focus areas nobody has seen yet
+            first_of_area = {}
+            for i in remaining:
+                if images[i].focus_area in uncovered_focus_areas:
+                    first_of_area.setdefault(images[i].focus_area, i)
+            wave = list(first_of_area.values())[:wave_size]
+        else:
+            wave = remaining[:wave_size]
+        if not wave:
+            break
+        remaining = [i for i in remaining if i not in wave]
+
+        raw_analyses = await analyze_car_images_concurrently(
+            [images[i] for i in wave], request_id, images_per_call=images_per_call, deadline=deadline
+        )
+        for i, raw_analysis in zip(wave, raw_analyses):
+            if isinstance(raw_analysis, Exception):
+                errors[i] = raw_analysis
+                # Another image of the area may still cover it; when none is left, stop waiting for it
+                area = images[i].focus_area
+                if not any(images[j].focus_area == area for j in remaining):
+                    uncovered_focus_areas.discard(area)
+                continue
+            result = build_image_result(images[i].name, raw_analysis)
+            results[i] = result
+            uncovered_focus_areas.discard(images[i].focus_area)
+            accumulator.add(result)
+
+    return (
+        [images[i] for i in sorted(results)],
+        [results[i] for i in sorted(results)],
+        [(images[i], errors[i]) for i in sorted(errors)],
+        sorted(remaining),
+        accumulator
+    )
+
+def build_image_result(image_name, raw_analysis):
+    """Parse one model answer into an ImageAnalysisResult"""
+    with stage('parse'):
+        characteristics = parse_model_output(raw_analysis)
+    return ImageAnalysisResult(
+        image_name=image_name,
+        characteristics=characteristics,
+        confidence_score=calculate_confidence_score(characteristics),
+        analysis_notes=raw_analysis,
+        prompt_version=getattr(raw_analysis, 'prompt_version', None)
+    )
+
+def summarize_analyses(individual_analyses, accumulator=None):
+    """Consolidate per-image results, then price and summarize the car.
+
+    accumulator already holds the votes of individual_analyses when they were
+    counted as they came in, so they are not counted again.
+    """
+    with stage('consolidate'):
+        if accumulator is None:
+            consolidated_characteristics, overall_confidence = consolidate_multiple_analyses(individual_analyses)
+        else:
+            consolidated_characteristics, overall_confidence = accumulator.result()
     
-    # Calculate overall confidence
-    overall_confidence = statistics.mean(confidence_scores) if confidence_scores else 0.0
+    # Generate price estimation based on consolidated data
+    with stage('pricing'):
+        price_estimation = estimate_price_factors(consolidated_characteristics)
     
-    return consolidated, overall_confidence
+    analysis_summary = generate_analysis_summary(
+        individual_analyses, 
+        consolidated_characteristics, 
+        overall_confidence
+    )
+    return consolidated_characteristics, price_estimation, analysis_summary
+
+def partial_results_report(analyzed_images, errors, overall_confidence):
+    """How the failed images reduce coverage and confidence of the consolidated result"""
+    attempted = len(analyzed_images) + len(errors)
+    coverage = len(analyzed_images) / attempted if attempted else 0.0
+    adjusted_confidence = overall_confidence * coverage
+    missing_focus_areas = {image.focus_area for image, _ in errors} - {image.focus_area for image in analyzed_images}
+    return {
+        'images_analyzed': len(analyzed_images),
+        'images_failed': len(errors),
+        'coverage': round(coverage, 2),
+        'adjusted_confidence': round(adjusted_confidence, 2),
+        'confidence_impact': round(adjusted_confidence - overall_confidence, 2),
+        'missing_focus_areas': sorted(missing_focus_areas)
+    }
+
+def consolidate_multiple_analyses(analyses_results):
+    """Consolidate multiple image analyses into a single comprehensive result.
+
+    Each field takes the value with the most confidence-weighted votes after
+    normalization; fields no image determined are "Not determined".
+    """
+    return ConsolidationAccumulator.from_results(analyses_results).result()
 
 def generate_analysis_summary(individual_analyses, consolidated_characteristics, overall_confidence):
     """Generate a summary of the multi-image analysis"""
@@ -100,6 +422,7 @@ def generate_analysis_summary(individual_analyses, consolidated_characteristics,
 
 def estimate_price_factors(characteristics):
     """Estimate price factors based on consolidated characteristics"""
+    snapshot = current_snapshot()
     brand = characteristics.get('brand', '').lower()
     
     # Use the worst condition among all condition factors
@@ -112,16 +435,16 @@ def estimate_price_factors(characteristics):
     
     condition_scores = []
     for cond in conditions:
-        if cond in CONDITION_MULTIPLIERS:
-            condition_scores.append(CONDITION_MULTIPLIERS[cond])
+        if cond in snapshot.condition_multipliers:
+            condition_scores.append(snapshot.condition_multipliers[cond])
     
     # Use average condition score, but weight it conservatively
     condition_factor = min(condition_scores) if condition_scores else 0.8
     
     segment = characteristics.get('market_segment', '').lower()
     
-    base_price = SEGMENT_BASE_PRICES.get(segment, 20000)
-    brand_factor = next((v for k, v in BRAND_MULTIPLIERS.items() if k in brand), 1.0)
+    base_price = snapshot.segment_base_prices.get(segment, 20000)
+    brand_factor = snapshot.brand_index.factor(brand)
     
     estimated_price = base_price * brand_factor * condition_factor
     
@@ -0,0 +1,62 @@
+"""Helpers shared by the benchmark scripts."""
+import io
+import json
+import math
+import os
+import platform
+import random
+import sys
+from datetime import datetime
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCHMARKS_DIR)
+CORPUS_PATH = os.path.join(BENCHMARKS_DIR, 'corpus', 'model_outputs.json')
+
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+def load_corpus(path=CORPUS_PATH):
+    """Recorded model outputs as a list of {'focus_area', 'content'} entries"""
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+    return ordered[rank]
+
+def latency_summary(seconds):
+    """p50/p95/p99/max of a list of latencies, in milliseconds"""
+    return {
+        'p50_ms': round(percentile(seconds, 50) * 1000, 2),
+        'p95_ms': round(percentile(seconds, 95) * 1000, 2),
+        'p99_ms': round(percentile(seconds, 99) * 1000, 2),
+        'max_ms': round(max(seconds) * 1000, 2) if seconds else 0.0,
+    }
+
+def synthetic_jpeg(seed, size=(1280, 960)):
+    """A distinct JPEG per seed, so uploads miss the cache and survive near-duplicate removal"""
+    from PIL import Image
+    rng = random.Random(seed)
+    image = Image.new('RGB', (16, 12))
+    image.putdata([tuple(rng.randrange(256) for _ in range(3)) for _ in range(16 * 12)])
+    buffer = io.BytesIO()
+    image.resize(size).save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+def write_report(report, path=None):
+    """Print a benchmark report and optionally save it as JSON for comparing runs"""
+    report = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        **report,
+    }
+    print(json.dumps(report, indent=2))
+    if path:
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
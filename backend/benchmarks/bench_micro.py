@@ -0,0 +1,99 @@
+"""Micro-benchmarks for the CPU-bound post-processing steps.
+
+Times parse_characteristics, consolidate_multiple_analyses, adding one
+image to and merging ConsolidationAccumulators, and estimate_price_factors
+on the recorded corpus, and checks that consolidated values still price like
+the spelling most images used. Run from the backend directory:
+
+    python benchmarks/bench_micro.py --output micro.json
+"""
+import argparse
+import time
+
+from _common import load_corpus, write_report
+
+from analyzer import build_image_result, consolidate_multiple_analyses, estimate_price_factors
+from consolidation import ConsolidationAccumulator
+from models import ImageAnalysisResult
+from utils import parse_characteristics
+
+# (per-image (characteristics, confidence), consolidated values the majority spelling gives)
+PRICING_CASES = [
+    ([({'brand': 'Toyota', 'body_condition': 'Good'}, 0.5)] * 3
+     + [({'brand': 'TOYOTA.', 'body_condition': 'Good - minor scratches'}, 0.9)],
+     {'brand': 'Toyota', 'body_condition': 'Good'}),
+    ([({'paint_condition': 'fair'}, 0.4), ({'paint_condition': 'Fair, faded roof'}, 0.8),
+      ({'paint_condition': 'fair'}, 0.3)],
+     {'paint_condition': 'fair'}),
+]
+
+def check_consolidated_pricing():
+    """Cases whose consolidated values or price differ from the majority spelling's"""
+    failures = []
+    for i, (images, expected) in enumerate(PRICING_CASES):
+        analyses = [
+            ImageAnalysisResult(image_name=f'image_{j}.jpg', characteristics=characteristics,
+                                confidence_score=confidence, analysis_notes='')
+            for j, (characteristics, confidence) in enumerate(images)
+        ]
+        consolidated = consolidate_multiple_analyses(analyses)[0]
+        if consolidated != expected or estimate_price_factors(consolidated) != estimate_price_factors(expected):
+            failures.append({'case': i, 'consolidated': consolidated, 'expected': expected})
+    return failures
+
+def measure(func, inputs, min_seconds):
+    """Call func over inputs until min_seconds have passed, returns per-call statistics"""
+    for item in inputs:
+        func(item)  # warm-up
+    calls, rounds = 0, []
+    started = time.perf_counter()
+    while time.perf_counter() - started < min_seconds:
+        round_started = time.perf_counter()
+        for item in inputs:
+            func(item)
+        rounds.append((time.perf_counter() - round_started) / len(inputs))
+        calls += len(inputs)
+    rounds.sort()
+    return {
+        'calls': calls,
+        'mean_us': round(sum(rounds) / len(rounds) * 1e6, 2),
+        'median_us': round(rounds[len(rounds) // 2] * 1e6, 2),
+        'min_us': round(rounds[0] * 1e6, 2),
+        'calls_per_second': round(len(rounds) / sum(rounds)),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--min-seconds', type=float, default=2.0, help='time spent on each function')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    texts = [entry['content'] for entry in load_corpus()]
+    results = [build_image_result(f'image_{i}.jpg', text) for i, text in enumerate(texts)]
+    # One car photographed from several angles, plus smaller groups
+    analysis_sets = [results, results[:3], results[:5], results[4:]]
+    consolidated = [consolidate_multiple_analyses(analyses)[0] for analyses in analysis_sets]
+    # Streaming adds one image to the votes of the images before it
+    running = ConsolidationAccumulator.from_results(results)
+    shards = [ConsolidationAccumulator.from_results(analyses) for analyses in analysis_sets]
+
+    report = {
+        'benchmark': 'micro',
+        'corpus_outputs': len(texts),
+        'functions': {
+            'parse_characteristics': measure(parse_characteristics, texts, args.min_seconds),
+            'consolidate_multiple_analyses': measure(consolidate_multiple_analyses, analysis_sets, args.min_seconds),
+            'accumulator_add': measure(running.add, results, args.min_seconds),
+            'accumulator_merge': measure(lambda shard: ConsolidationAccumulator().merge(shard).merge(running), shards,
+                                         args.min_seconds),
+            'estimate_price_factors': measure(estimate_price_factors, consolidated, args.min_seconds),
+        },
+    }
+    failures = check_consolidated_pricing()
+    report['pricing_check_failures'] = failures
+    write_report(report, args.output)
+    if failures:
+        raise SystemExit(f"{len(failures)} consolidated results no longer price like the majority spelling")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""Compare per-image analysis with packing several images into one model call
+and with adaptive early termination.
+
+Needs a running Ollama server (OLLAMA_HOST) with MODEL_NAME pulled. Run from
+the backend directory with a folder holding photos of one car:
+
+    python benchmarks/bench_multi_image.py path/to/car_photos --group-sizes 2 3 5
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import time
+
+from _common import write_report
+
+from analyzer import (
+    analyze_car_images_adaptive, analyze_car_images_concurrently, build_image_result, consolidate_multiple_analyses
+)
+from cache import analysis_cache
+from preprocessing import preprocess_images
+from uploads import UploadedImage
+from utils import determine_focus_area
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+def load_images(directory):
+    images = []
+    for i, name in enumerate(sorted(os.listdir(directory))):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            with open(os.path.join(directory, name), 'rb') as f:
+                data = f.read()
+            images.append(UploadedImage(data, name, determine_focus_area(name, i), hashlib.sha256(data).hexdigest()))
+    return images
+
+async def run_mode(images, images_per_call):
+    # Every run must reach the model
+    analysis_cache.clear()
+    started = time.perf_counter()
+    raw_analyses = await analyze_car_images_concurrently(images, images_per_call=images_per_call)
+    seconds = time.perf_counter() - started
+
+    results = [build_image_result(image.name, raw) for image, raw in zip(images, raw_analyses)
+               if not isinstance(raw, Exception)]
+    consolidated, confidence = consolidate_multiple_analyses(results) if results else ({}, 0.0)
+    return seconds, consolidated, confidence, len(images) - len(results)
+
+async def run_adaptive(images):
+    analysis_cache.clear()
+    started = time.perf_counter()
+    _, results, _, skipped, _ = await analyze_car_images_adaptive(images)
+    seconds = time.perf_counter() - started
+    consolidated, confidence = consolidate_multiple_analyses(results) if results else ({}, 0.0)
+    return seconds, consolidated, confidence, len(results)
+
+def agreement(reference, candidate):
+    """Share of determined reference fields that the candidate reproduces"""
+    keys = [k for k, v in reference.items() if v != "Not determined"]
+    if not keys:
+        return 0.0
+    same = sum(1 for k in keys if str(candidate.get(k, '')).strip().lower() == str(reference[k]).strip().lower())
+    return same / len(keys)
+
+async def benchmark(images, group_sizes, repeats):
+    images, _, _ = await preprocess_images(images, dedupe=False)
+    report = {'benchmark': 'multi_image_modes', 'images': len(images), 'runs': []}
+
+    baseline = None
+    for images_per_call in [1] + group_sizes:
+        for repeat in range(repeats):
+            seconds, consolidated, confidence, failed = await run_mode(images, images_per_call)
+            if images_per_call == 1 and baseline is None:
+                baseline = consolidated
+            report['runs'].append({
+                'images_per_call': images_per_call,
+                'repeat': repeat,
+                'model_calls': -(-len(images) // images_per_call),
+                'seconds': round(seconds, 3),
+                'overall_confidence': round(confidence, 3),
+                'failed_images': failed,
+                'agreement_with_per_image': round(agreement(baseline, consolidated), 3),
+            })
+            print(json.dumps(report['runs'][-1]))
+
+    for repeat in range(repeats):
+        seconds, consolidated, confidence, analyzed = await run_adaptive(images)
+        report['runs'].append({
+            'mode': 'adaptive',
+            'repeat': repeat,
+            'model_calls': analyzed,
+            'seconds': round(seconds, 3),
+            'overall_confidence': round(confidence, 3),
+            'agreement_with_per_image': round(agreement(baseline, consolidated), 3),
+        })
+        print(json.dumps(report['runs'][-1]))
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('directory', help='folder with photos of one car')
+    parser.add_argument('--group-sizes', type=int, nargs='+', default=[2, 3])
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    images = load_images(args.directory)
+    if not images:
+        sys.exit(f"No images found in {args.directory}")
+
+    report = asyncio.run(benchmark(images, args.group_sizes, args.repeats))
+    write_report(report, args.output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Compare the single-pass characteristic parser with the original per-key regex loop.
+
+Run from the backend directory:  python benchmarks/bench_parser.py --repeat 2000
+"""
+import argparse
+import re
+import time
+
+from _common import load_corpus, write_report
+
+from utils import parse_characteristics
+
+# The parser as it shipped before the single-pass rewrite
+LEGACY_PATTERNS = {
+    'vehicle_type': r'VEHICLE TYPE:?\s*(.+)',
+    'brand': r'BRAND/MAKE:?\s*(.+)',
+    'model': r'MODEL:?\s*(.+)',
+    'year': r'APPROXIMATE YEAR:?\s*(.+)',
+    'body_condition': r'BODY CONDITION:?\s*(.+)',
+    'paint_condition': r'PAINT CONDITION:?\s*(.+)',
+    'wheel_condition': r'WHEEL/TIRE CONDITION:?\s*(.+)',
+    'size_category': r'SIZE CATEGORY:?\s*(.+)',
+    'special_features': r'SPECIAL FEATURES:?\s*(.+)',
+    'mileage_category': r'ESTIMATED MILEAGE CATEGORY:?\s*(.+)',
+    'market_segment': r'MARKET SEGMENT:?\s*(.+)',
+    'damage': r'NOTABLE DAMAGE:?\s*(.+)',
+    'interior_condition': r'INTERIOR CONDITION:?\s*(.+)',
+    'modifications': r'MODIFICATIONS:?\s*(.+)',
+    'confidence_level': r'CONFIDENCE_LEVEL:?\s*(.+)',
+    'overall_exterior_grade': r'OVERALL_EXTERIOR_GRADE:?\s*(.+)',
+    'overall_interior_grade': r'OVERALL_INTERIOR_GRADE:?\s*(.+)',
+    'overall_wheel_grade': r'OVERALL_WHEEL_GRADE:?\s*(.+)',
+}
+
+def legacy_parse_characteristics(analysis_text):
+    characteristics = {}
+    for key, pattern in LEGACY_PATTERNS.items():
+        match = re.search(pattern, analysis_text, re.IGNORECASE)
+        characteristics[key] = match.group(1).strip() if match else "Not specified"
+    return characteristics
+
+def time_parser(parser, texts):
+    started = time.perf_counter()
+    results = [parser(text) for text in texts]
+    return time.perf_counter() - started, results
+
+def fill_rate(results):
+    values = [v for result in results for v in result.values()]
+    return sum(1 for v in values if v != "Not specified") / len(values)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=2000, help='copies of the corpus to parse')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    texts = [entry['content'] for entry in load_corpus()] * args.repeat
+    # Warm up both code paths (regex compile caches, first-call costs)
+    time_parser(legacy_parse_characteristics, texts[:100])
+    time_parser(parse_characteristics, texts[:100])
+
+    legacy_seconds, legacy_results = time_parser(legacy_parse_characteristics, texts)
+    single_seconds, single_results = time_parser(parse_characteristics, texts)
+
+    report = {
+        'benchmark': 'parse_characteristics',
+        'outputs_parsed': len(texts),
+        'legacy_seconds': round(legacy_seconds, 4),
+        'single_pass_seconds': round(single_seconds, 4),
+        'legacy_us_per_output': round(legacy_seconds / len(texts) * 1e6, 2),
+        'single_pass_us_per_output': round(single_seconds / len(texts) * 1e6, 2),
+        'speedup': round(legacy_seconds / single_seconds, 2),
+        'legacy_fill_rate': round(fill_rate(legacy_results), 3),
+        'single_pass_fill_rate': round(fill_rate(single_results), 3),
+    }
+    write_report(report, args.output)
+
+if __name__ == '__main__':
+    main()
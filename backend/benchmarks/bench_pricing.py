@@ -0,0 +1,75 @@
+"""Compare bulk NumPy pricing with calling estimate_price_factors per record.
+
+Run from the backend directory:  python benchmarks/bench_pricing.py --rows 100000
+"""
+import argparse
+import gc
+import random
+import time
+
+from _common import write_report
+
+from analyzer import estimate_price_factors
+from pricing import estimate_prices_bulk, price_arrays
+
+BRANDS = ['Toyota', 'BMW', 'Mercedes-Benz', 'Acura', 'Ford', 'Lamborghini', 'Volkswagen', 'Unknown',
+          'Kia', 'Honda (likely)', 'Chevrolet Silverado', 'Not specified', 'Peugeot', 'Porsche']
+SEGMENTS = ['luxury', 'Economy', 'mid-range', 'sports', 'commercial', 'Not specified', 'premium']
+CONDITIONS = ['excellent', 'Good', 'fair', 'poor', 'Not visible', 'Not specified', 'good, minor scratches']
+YEARS = ['2018', '2015-2017', 'around 2012', 'Not specified', 'late 1990s', '2021', 'Unknown', '2008']
+MILEAGE = ['low', 'medium', 'high', 'Not specified']
+
+def synthetic_records(rows, seed=0):
+    rng = random.Random(seed)
+    return [{
+        'brand': rng.choice(BRANDS),
+        'market_segment': rng.choice(SEGMENTS),
+        'year': rng.choice(YEARS),
+        'body_condition': rng.choice(CONDITIONS),
+        'paint_condition': rng.choice(CONDITIONS),
+        'interior_condition': rng.choice(CONDITIONS),
+        'wheel_condition': rng.choice(CONDITIONS),
+        'mileage_category': rng.choice(MILEAGE),
+        'damage': rng.choice(['none', 'damaged bumper', 'Not specified']),
+        'modifications': rng.choice(['none', 'Not specified']),
+    } for _ in range(rows)]
+
+def timed(repeats, func, *args, **kwargs):
+    """Best time over repeats and the last result"""
+    best = float('inf')
+    for _ in range(repeats):
+        gc.collect()
+        started = time.perf_counter()
+        result = func(*args, **kwargs)
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    records = synthetic_records(args.rows)
+    scalar_seconds, scalar_results = timed(args.repeats, lambda: [estimate_price_factors(r) for r in records])
+    bulk_seconds, bulk_results = timed(args.repeats, estimate_prices_bulk, records)
+    arrays_seconds, _ = timed(args.repeats, price_arrays, records)
+
+    mismatches = sum(1 for a, b in zip(scalar_results, bulk_results) if a != b)
+    report = {
+        'benchmark': 'bulk_pricing',
+        'rows': args.rows,
+        'scalar_seconds': round(scalar_seconds, 4),
+        'bulk_seconds': round(bulk_seconds, 4),
+        'bulk_arrays_only_seconds': round(arrays_seconds, 4),
+        'speedup': round(scalar_seconds / bulk_seconds, 2),
+        'arrays_only_speedup': round(scalar_seconds / arrays_seconds, 2),
+        'mismatches': mismatches,
+    }
+    write_report(report, args.output)
+    if mismatches:
+        raise SystemExit(f"{mismatches} bulk results differ from estimate_price_factors")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""Load test /analyze and /analyze-multiple against the stub Ollama server.
+
+Starts one or more stub Ollama servers and the API (uvicorn, in a subprocess
+pointed at the stubs via OLLAMA_HOSTS, optionally with several worker
+processes) and waits until /ready reports the model warmed up.
+It then drives each endpoint at fixed concurrency levels and reports latency
+percentiles, requests/sec and peak server RSS, plus the API's startup timings.
+Run from the backend directory:
+
+    python benchmarks/load_test.py --concurrency 1 4 16 --requests 40 --output load.json
+    python benchmarks/load_test.py --backends 3 --workers 2 --concurrency 16
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import httpx
+
+from _common import BACKEND_DIR, latency_summary, synthetic_jpeg, write_report
+from stub_ollama import start_stub_server
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def process_tree_rss(pid):
+    """Resident memory of a process and its children in bytes, None where /proc is unavailable"""
+    try:
+        total, pending = 0, [pid]
+        while pending:
+            current = pending.pop()
+            with open(f'/proc/{current}/status') as f:
+                total += next(int(line.split()[1]) * 1024 for line in f if line.startswith('VmRSS:'))
+            for task in os.listdir(f'/proc/{current}/task'):
+                with open(f'/proc/{current}/task/{task}/children') as f:
+                    pending.extend(int(child) for child in f.read().split())
+        return total
+    except (OSError, StopIteration):
+        return None
+
+class RssSampler:
+    """Tracks the peak RSS of the server process tree on a background thread"""
+
+    def __init__(self, pid, interval=0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.peak = None
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss = process_tree_rss(self.pid)
+            if rss is not None:
+                self.peak = max(self.peak or 0, rss)
+            self._stop.wait(self.interval)
+
+def start_api(port, ollama_hosts, workers=1):
+    """Start the API and wait until it is ready, returns (process, readiness report)"""
+    env = {**os.environ, 'OLLAMA_HOSTS': ','.join(ollama_hosts)}
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--port', str(port), '--log-level', 'warning',
+         '--workers', str(workers)],
+        cwd=BACKEND_DIR, env=env
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            response = httpx.get(f'http://127.0.0.1:{port}/ready')
+            if response.status_code == 200:
+                return process, response.json()
+        except httpx.TransportError:
+            pass
+        time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("API did not become ready within 60s")
+
+def build_requests(endpoint, count, images_per_request, seed):
+    """Multipart payloads with distinct images, so neither the cache nor dedupe short-circuits the model"""
+    payloads = []
+    for i in range(count):
+        if endpoint == '/analyze':
+            payloads.append({'file': (f'car_{i}.jpg', synthetic_jpeg(seed + i), 'image/jpeg')})
+        else:
+            payloads.append([
+                ('files', (f'car_{i}_{j}.jpg', synthetic_jpeg(seed + i * images_per_request + j), 'image/jpeg'))
+                for j in range(images_per_request)
+            ])
+    return payloads
+
+async def run_level(base_url, endpoint, payloads, concurrency):
+    latencies, statuses = [], {}
+    pending = iter(payloads)
+
+    async def worker(client):
+        for files in pending:
+            started = time.perf_counter()
+            try:
+                response = await client.post(endpoint, files=files)
+                status = str(response.status_code)
+            except httpx.TransportError as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=None) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        wall_seconds = time.perf_counter() - started
+
+    return {
+        'requests': len(latencies),
+        'statuses': statuses,
+        'wall_seconds': round(wall_seconds, 3),
+        'requests_per_second': round(statuses.get('200', 0) / wall_seconds, 3),
+        **latency_summary(latencies),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--requests', type=int, default=40, help='requests per endpoint and concurrency level')
+    parser.add_argument('--images', type=int, default=4, help='images per /analyze-multiple request')
+    parser.add_argument('--endpoints', nargs='+', default=['/analyze', '/analyze-multiple'])
+    parser.add_argument('--latency', type=float, default=0.5, help='stub model latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.1)
+    parser.add_argument('--load-time', type=float, default=2.0, help='stub model load time in seconds')
+    parser.add_argument('--backends', type=int, default=1, help='stub Ollama servers behind the API')
+    parser.add_argument('--workers', type=int, default=1, help='uvicorn worker processes')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    stubs = [
+        start_stub_server(latency=args.latency, jitter=args.jitter, seed=i, load_time=args.load_time)
+        for i in range(args.backends)
+    ]
+    model_calls = lambda: [stub.requests for _, stub in stubs]
+    port = free_port()
+    api, readiness = start_api(
+        port, [f'http://127.0.0.1:{server.server_port}' for server, _ in stubs], args.workers
+    )
+    sampler = RssSampler(api.pid)
+    report = {
+        'benchmark': 'load_test',
+        'stub_latency_seconds': args.latency,
+        'stub_jitter_seconds': args.jitter,
+        'images_per_multi_request': args.images,
+        'backends': args.backends,
+        'workers': args.workers,
+        'startup': {key: readiness[key] for key in (
+            'startup_seconds', 'model_load_seconds', 'warmup_inference_seconds', 'cold_start_seconds',
+            'time_to_ready_seconds'
+        )},
+        'runs': [],
+    }
+    try:
+        seed = 0
+        for endpoint in args.endpoints:
+            for concurrency in args.concurrency:
+                payloads = build_requests(endpoint, args.requests, args.images, seed)
+                seed += args.requests * args.images
+                model_calls_before = model_calls()
+                with sampler:
+                    result = asyncio.run(run_level(f'http://127.0.0.1:{port}', endpoint, payloads, concurrency))
+                report['runs'].append({
+                    'endpoint': endpoint,
+                    'concurrency': concurrency,
+                    **result,
+                    'model_calls_per_backend': [
+                        after - before for before, after in zip(model_calls_before, model_calls())
+                    ],
+                    'peak_rss_mb': round(sampler.peak / 2**20, 1) if sampler.peak else None,
+                })
+                print(f"{endpoint} c={concurrency}: {result['requests_per_second']} req/s, "
+                      f"p95 {result['p95_ms']} ms", file=sys.stderr)
+    finally:
+        api.terminate()
+        api.wait()
+        for server, _ in stubs:
+            server.shutdown()
+
+    write_report(report, args.output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""Stand-in Ollama server that replays recorded model outputs.
+
+Answers /api/chat with outputs from corpus/model_outputs.json after a
+configurable delay, so the API can be load tested without a GPU. The first
+call pays a simulated model load. Point the backend at it with OLLAMA_HOST:
+
+    python benchmarks/stub_ollama.py --port 11500 --latency 1.5 --jitter 0.3 --load-time 3
+    OLLAMA_HOST=http://127.0.0.1:11500 uvicorn main:app
+
+--count starts several stubs on consecutive ports, e.g. to try the API
+against a pool of Ollama hosts:
+
+    python benchmarks/stub_ollama.py --port 11500 --count 3
+    OLLAMA_HOSTS=http://127.0.0.1:11500,http://127.0.0.1:11501,http://127.0.0.1:11502 uvicorn main:app
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from _common import load_corpus
+
+from config import MODEL_NAME
+from utils import parse_characteristics
+
+def detect_focus_area(prompt):
+    """Which focus area prompt a chat request was built from"""
+    if 'INTERIOR condition' in prompt:
+        return 'interior'
+    if 'WHEELS and TIRES' in prompt:
+        return 'wheels'
+    if 'EXTERIOR condition' in prompt:
+        return 'exterior'
+    return 'general'
+
+def as_structured_output(content):
+    """JSON version of a recorded free-text output, for format='json' requests"""
+    fields = parse_characteristics(content)
+    return json.dumps({key: value for key, value in fields.items() if value != "Not specified"})
+
+class StubOllama:
+    """Replays corpus outputs round-robin per focus area with latency and jitter"""
+
+    def __init__(self, latency=1.0, jitter=0.0, seed=0, corpus=None, load_time=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.load_time = load_time
+        self._loaded = False
+        self._random = random.Random(seed)
+        self._outputs = {}
+        for entry in corpus or load_corpus():
+            self._outputs.setdefault(entry['focus_area'], []).append(entry['content'])
+        self._positions = {focus_area: 0 for focus_area in self._outputs}
+        self._lock = threading.Lock()
+        self.requests = 0
+
+    def _next_output(self, focus_area):
+        with self._lock:
+            self.requests += 1
+            outputs = self._outputs.get(focus_area) or self._outputs['general']
+            position = self._positions.get(focus_area, 0)
+            self._positions[focus_area] = position + 1
+            delay = max(0.0, self._random.gauss(self.latency, self.jitter)) if self.jitter else self.latency
+        return outputs[position % len(outputs)], delay
+
+    def _load_model(self):
+        """Seconds spent loading the model; only the first call pays it"""
+        with self._lock:
+            if self._loaded:
+                return 0.0
+            self._loaded = True
+        time.sleep(self.load_time)
+        return self.load_time
+
+    def chat(self, payload):
+        load_ns = int(self._load_model() * 1e9)
+        if not payload.get('messages'):
+            # An empty chat only loads the model, as Ollama does for preload requests
+            return {
+                'model': payload.get('model', MODEL_NAME),
+                'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                'message': {'role': 'assistant', 'content': ''},
+                'done': True,
+                'total_duration': load_ns,
+                'load_duration': load_ns,
+            }
+        message = payload['messages'][-1]
+        prompt = message.get('content', '')
+        images = message.get('images') or []
+
+        if len(images) > 1:
+            # Several images packed into one call, answer one section per image
+            sections, delay = [], 0.0
+            for i in range(1, len(images) + 1):
+                content, delay = self._next_output('general')
+                sections.append(f"**IMAGE {i}:**\n{content}")
+            content = "\n\n".join(sections)
+        else:
+            content, delay = self._next_output(detect_focus_area(prompt))
+        if payload.get('format') == 'json':
+            content = as_structured_output(content)
+
+        time.sleep(delay)
+        eval_count = max(1, len(content) // 4)
+        delay_ns = int(delay * 1e9)
+        return {
+            'model': payload.get('model', MODEL_NAME),
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'message': {'role': 'assistant', 'content': content},
+            'done': True,
+            'total_duration': delay_ns + load_ns,
+            'load_duration': load_ns,
+            'prompt_eval_count': 600 * max(1, len(images)),
+            'prompt_eval_duration': delay_ns // 4,
+            'eval_count': eval_count,
+            'eval_duration': delay_ns - delay_ns // 4,
+        }
+
+def make_handler(stub):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _send_json(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == '/api/tags':
+                self._send_json(200, {'models': [{'name': MODEL_NAME}]})
+            else:
+                self._send_json(404, {'error': 'not found'})
+
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if self.path == '/api/chat':
+                self._send_json(200, stub.chat(payload))
+            else:
+                self._send_json(404, {'error': 'not found'})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+def start_stub_server(port=0, latency=1.0, jitter=0.0, seed=0, load_time=0.0):
+    """Serve a StubOllama on a background thread, returns (server, stub)"""
+    stub = StubOllama(latency, jitter, seed, load_time=load_time)
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(stub))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, stub
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=11500)
+    parser.add_argument('--latency', type=float, default=1.0, help='mean seconds per model call')
+    parser.add_argument('--jitter', type=float, default=0.0, help='standard deviation of the latency')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--load-time', type=float, default=0.0, help='seconds the first call spends loading the model')
+    parser.add_argument('--count', type=int, default=1, help='stub servers to start on consecutive ports')
+    args = parser.parse_args()
+
+    servers = []
+    for i in range(args.count):
+        server, _ = start_stub_server(args.port + i, args.latency, args.jitter, args.seed + i, args.load_time)
+        servers.append(server)
+        print(f"Stub Ollama listening on http://127.0.0.1:{server.server_port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        for server in servers:
+            server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from config import (
+    MODEL_NAME, CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS, CACHE_DB_PATH, CACHE_DB_MAX_ENTRIES, CACHE_DB_PRUNE_EVERY,
+    PREPROCESS_IMAGES, PREPROCESS_MAX_EDGE, PREPROCESS_JPEG_QUALITY
+)
+from config_snapshot import current_snapshot
+
+def image_digest(image_data):
+    """Content digest of the raw image bytes"""
+    return hashlib.sha256(image_data).hexdigest()
+
+# What the model actually sees depends on the preprocessing settings too
+PREPROCESSING_SIGNATURE = (
+    f"jpeg:{PREPROCESS_MAX_EDGE}:{PREPROCESS_JPEG_QUALITY}" if PREPROCESS_IMAGES else "original"
+)
+
+def make_cache_key(digest, focus_area, model=MODEL_NAME, prompt=None):
+    """Cache key for a model result; changes whenever the model, prompt text or preprocessing changes"""
+    if prompt is None:
+        prompt_digests = current_snapshot().prompt_digests
+        prompt_digest = prompt_digests.get(focus_area, prompt_digests['general'])
+    else:
+        prompt_digest = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+
+    key = hashlib.sha256()
+    for part in (digest, focus_area, model, prompt_digest, PREPROCESSING_SIGNATURE):
+        key.update(part.encode('utf-8'))
+        key.update(b'\0')
+    return key.hexdigest()
+
+class AnalysisCache:
+    """Two-tier cache of raw model output: an in-memory LRU and an optional sqlite file.
+
+    The *_async methods answer from memory on the event loop and run sqlite
+    work in a thread. The sqlite tier drops expired rows and keeps at most
+    max_disk_entries, checked every prune_every writes.
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl_seconds=CACHE_TTL_SECONDS, db_path=CACHE_DB_PATH,
+                 max_disk_entries=CACHE_DB_MAX_ENTRIES, prune_every=CACHE_DB_PRUNE_EVERY):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_disk_entries = max_disk_entries
+        self.prune_every = prune_every
+        self._entries = OrderedDict()  # key -> (stored_at, value)
+        self._lock = threading.Lock()
+        self._counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0, 'disk_evictions': 0}
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._writes_since_prune = 0
+
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.executescript(
+                "CREATE TABLE IF NOT EXISTS analysis_cache "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL);"
+                "CREATE INDEX IF NOT EXISTS analysis_cache_stored_at ON analysis_cache (stored_at);"
+            )
+            with self._db_lock:
+                self._prune_disk()
+
+    @property
+    def disk_enabled(self):
+        """Whether results are kept in sqlite, which every worker process shares"""
+        return self._db is not None
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss"""
+        now = time.time()
+        value = self._get_memory(key, now)
+        if value is None and self._db is not None:
+            value = self._hit_disk(key, self._get_disk(key, now))
+        return self._count(value)
+
+    async def get_async(self, key):
+        """get() with the sqlite lookup off the event loop"""
+        now = time.time()
+        value = self._get_memory(key, now)
+        if value is None and self._db is not None:
+            value = self._hit_disk(key, await asyncio.to_thread(self._get_disk, key, now))
+        return self._count(value)
+
+    def peek(self, key):
+        """Whether a fresh entry exists, without touching LRU order or counters"""
+        return bool(self._peek_memory([key])) or key in self._peek_disk([key])
+
+    async def peek_async(self, key):
+        return key in await self.peek_many_async([key])
+
+    async def peek_many_async(self, keys):
+        """The subset of keys with a fresh entry in either tier, in one sqlite query"""
+        found = self._peek_memory(keys)
+        rest = [key for key in keys if key not in found]
+        if rest and self._db is not None:
+            found |= await asyncio.to_thread(self._peek_disk, rest)
+        return found
+
+    def set(self, key, value):
+        """Store a value in both tiers"""
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+        if self._db is not None:
+            self._set_disk(key, value, now)
+
+    async def set_async(self, key, value):
+        """set() with the sqlite write off the event loop"""
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+        if self._db is not None:
+            await asyncio.to_thread(self._set_disk, key, value, now)
+
+    def clear(self):
+        """Drop the in-memory tier"""
+        with self._lock:
+            self._entries.clear()
+
+    def _get_memory(self, key, now):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if now - entry[0] <= self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self._counters['memory_hits'] += 1
+                return entry[1]
+            del self._entries[key]
+            return None
+
+    def _peek_memory(self, keys):
+        now = time.time()
+        with self._lock:
+            entries = [(key, self._entries.get(key)) for key in keys]
+        return {key for key, entry in entries if entry is not None and now - entry[0] <= self.ttl_seconds}
+
+    def _get_disk(self, key, now):
+        with self._db_lock:
+            row = self._db.execute("SELECT value, stored_at FROM analysis_cache WHERE key = ?", (key,)).fetchone()
+        return row if row and now - row[1] <= self.ttl_seconds else None
+
+    def _hit_disk(self, key, row):
+        if row is None:
+            return None
+        with self._lock:
+            self._remember(key, row[0], row[1])
+            self._counters['disk_hits'] += 1
+        return row[0]
+
+    def _count(self, value):
+        if value is None:
+            with self._lock:
+                self._counters['misses'] += 1
+        return value
+
+    def _peek_disk(self, keys):
+        if self._db is None:
+            return set()
+        oldest = time.time() - self.ttl_seconds
+        found = set()
+        with self._db_lock:
+            # Stays under sqlite's default limit of 999 bound parameters
+            for i in range(0, len(keys), 900):
+                chunk = keys[i:i + 900]
+                found.update(row[0] for row in self._db.execute(
+                    f"SELECT key FROM analysis_cache WHERE stored_at >= ? AND key IN ({', '.join('?' * len(chunk))})",
+                    (oldest, *chunk)
+                ))
+        return found
+
+    def _set_disk(self, key, value, now):
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO analysis_cache (key, value, stored_at) VALUES (?, ?, ?)", (key, value, now)
+            )
+            self._writes_since_prune += 1
+            if self._writes_since_prune >= self.prune_every:
+                self._prune_disk()
+            self._db.commit()
+
+    def _prune_disk(self):
+        """Delete expired rows, then the oldest beyond max_disk_entries; the caller holds _db_lock"""
+        self._writes_since_prune = 0
+        removed = self._db.execute(
+            "DELETE FROM analysis_cache WHERE stored_at < ?", (time.time() - self.ttl_seconds,)
+        ).rowcount
+        removed += self._db.execute(
+            "DELETE FROM analysis_cache WHERE key IN "
+            "(SELECT key FROM analysis_cache ORDER BY stored_at DESC LIMIT -1 OFFSET ?)", (self.max_disk_entries,)
+        ).rowcount
+        self._db.commit()
+        with self._lock:
+            self._counters['disk_evictions'] += removed
+
+    def _remember(self, key, value, stored_at):
+        self._entries[key] = (stored_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._counters['evictions'] += 1
+
+    def stats(self):
+        """Hit/miss counters and current size"""
+        with self._lock:
+            stats = dict(self._counters)
+            stats['memory_entries'] = len(self._entries)
+            stats['max_entries'] = self.max_entries
+            stats['disk_enabled'] = self.disk_enabled
+            stats['max_disk_entries'] = self.max_disk_entries
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['memory_hits'] + stats['disk_hits']) / lookups, 3) if lookups else 0.0
+        return stats
+
+analysis_cache = AnalysisCache()
@@ -1,6 +1,14 @@
 # Configuration settings and constants
+import os
 
 MODEL_NAME = 'llava'
+MODEL_KEEP_ALIVE = -1  # How long Ollama keeps the model loaded after a call: seconds, '30m', or -1 for always
+
+# Ollama backends: comma-separated URLs with optional weights, e.g.
+# OLLAMA_HOSTS="http://gpu1:11434=2,http://gpu2:11434". Empty uses OLLAMA_HOST or the local default.
+OLLAMA_HOSTS = os.environ.get('OLLAMA_HOSTS', '')
+OLLAMA_HEALTH_CHECK_SECONDS = 10  # /api/tags probe interval when there are several backends
+OLLAMA_FAILURE_COOLDOWN_SECONDS = 30  # A backend that errored gets no traffic for this long
 
 # Brand multipliers for price estimation
 BRAND_MULTIPLIERS = {
@@ -93,29 +101,136 @@ FOCUS_PROMPTS = {
     """
 }
 
-# Regex patterns for parsing characteristics
+# Structured output mode: ask the model for a compact JSON object instead of
+# free text. Each focus area lists the characteristic keys it fills and the
+# allowed values ("text" for free text).
+STRUCTURED_OUTPUT = False
+STRUCTURED_TOKENS_PER_KEY = 40  # Generation cap per schema key; free-text values and pretty-printing need room
+CONDITION_GRADES = "excellent|good|fair|poor|unknown"
+STRUCTURED_SCHEMAS = {
+    "general": {
+        'vehicle_type': "sedan|SUV|hatchback|coupe|convertible|truck|van|wagon|unknown",
+        'brand': "text",
+        'model': "text",
+        'year': "text",
+        'body_condition': CONDITION_GRADES,
+        'paint_condition': CONDITION_GRADES,
+        'wheel_condition': CONDITION_GRADES,
+        'size_category': "compact|mid-size|full-size|luxury|unknown",
+        'special_features': "text",
+        'mileage_category': "low|medium|high|unknown",
+        'market_segment': "economy|mid-range|luxury|sports|commercial|unknown",
+        'damage': "text",
+        'interior_condition': CONDITION_GRADES,
+        'modifications': "text",
+        'confidence_level': "high|medium|low",
+    },
+    "exterior": {
+        'body_condition': CONDITION_GRADES,
+        'paint_condition': CONDITION_GRADES,
+        'damage': "text",
+        'overall_exterior_grade': CONDITION_GRADES,
+        'confidence_level': "high|medium|low",
+    },
+    "interior": {
+        'interior_condition': CONDITION_GRADES,
+        'overall_interior_grade': CONDITION_GRADES,
+        'confidence_level': "high|medium|low",
+    },
+    "wheels": {
+        'wheel_condition': CONDITION_GRADES,
+        'overall_wheel_grade': CONDITION_GRADES,
+        'confidence_level': "high|medium|low",
+    },
+}
+
+# Regex patterns for the characteristic labels in the model output.
+# Spaces and underscores in a label match either separator.
 CHARACTERISTIC_PATTERNS = {
-    'vehicle_type': r'VEHICLE TYPE:?\s*(.+)',
-    'brand': r'BRAND/MAKE:?\s*(.+)',
-    'model': r'MODEL:?\s*(.+)',
-    'year': r'APPROXIMATE YEAR:?\s*(.+)',
-    'body_condition': r'BODY CONDITION:?\s*(.+)',
-    'paint_condition': r'PAINT CONDITION:?\s*(.+)',
-    'wheel_condition': r'WHEEL/TIRE CONDITION:?\s*(.+)',
-    'size_category': r'SIZE CATEGORY:?\s*(.+)',
-    'special_features': r'SPECIAL FEATURES:?\s*(.+)',
-    'mileage_category': r'ESTIMATED MILEAGE CATEGORY:?\s*(.+)',
-    'market_segment': r'MARKET SEGMENT:?\s*(.+)',
-    'damage': r'NOTABLE DAMAGE:?\s*(.+)',
-    'interior_condition': r'INTERIOR CONDITION:?\s*(.+)',
-    'modifications': r'MODIFICATIONS:?\s*(.+)',
-    'confidence_level': r'CONFIDENCE_LEVEL:?\s*(.+)',
-    'overall_exterior_grade': r'OVERALL_EXTERIOR_GRADE:?\s*(.+)',
-    'overall_interior_grade': r'OVERALL_INTERIOR_GRADE:?\s*(.+)',
-    'overall_wheel_grade': r'OVERALL_WHEEL_GRADE:?\s*(.+)',
+    'vehicle_type': r'VEHICLE TYPE',
+    'brand': r'BRAND(?:/MAKE)?',
+    'model': r'MODEL',
+    'year': r'(?:APPROXIMATE )?YEAR',
+    'body_condition': r'BODY CONDITION',
+    'paint_condition': r'PAINT CONDITION',
+    'wheel_condition': r'WHEEL/TIRE CONDITION',
+    'size_category': r'SIZE CATEGORY',
+    'special_features': r'SPECIAL FEATURES',
+    'mileage_category': r'(?:ESTIMATED )?MILEAGE CATEGORY',
+    'market_segment': r'MARKET SEGMENT',
+    'damage': r'NOTABLE DAMAGE',
+    'interior_condition': r'INTERIOR CONDITION',
+    'modifications': r'MODIFICATIONS',
+    'confidence_level': r'CONFIDENCE_LEVEL',
+    'overall_exterior_grade': r'OVERALL_EXTERIOR_GRADE',
+    'overall_interior_grade': r'OVERALL_INTERIOR_GRADE',
+    'overall_wheel_grade': r'OVERALL_WHEEL_GRADE',
 }
 
+# Runtime overrides for the pricing tables, prompts and label patterns above.
+# The JSON file maps lower-case table names (e.g. "brand_multipliers") to
+# replacement tables and is reloaded without a restart when it changes.
+CONFIG_OVERRIDES_PATH = 'config_overrides.json'  # None disables overrides
+CONFIG_RELOAD_POLL_SECONDS = 2
+
 # API configuration
 MAX_IMAGES_PER_REQUEST = 10
+MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB per image
+MAX_REQUEST_UPLOAD_SIZE = 50 * 1024 * 1024  # Upload bytes buffered per request
+UPLOAD_CHUNK_SIZE = 256 * 1024
+MAX_REQUEST_BODY_OVERHEAD = 1024 * 1024  # Multipart boundaries, headers and form fields on top of the upload limit
+MAX_CONCURRENT_ANALYSES = 4  # Vision model calls in flight per request
+IMAGES_PER_MODEL_CALL = 1  # Above 1, images of one car are packed into combined model calls
+MODEL_WORKER_SLOTS = 2  # Vision model calls in flight per Ollama backend, across all requests of a worker process
+API_WORKERS = int(os.environ.get('API_WORKERS', 1))  # uvicorn worker processes when run as `python main.py`
+MAX_QUEUED_MODEL_JOBS = 50  # Further jobs are rejected with 429
+MODEL_CALL_TIMEOUT_SECONDS = 120  # One model call; a hung call is cancelled and may be retried
+MODEL_CALL_RETRIES = 2  # Extra attempts after a timeout or backend error
+MODEL_RETRY_BACKOFF_SECONDS = 0.5  # Doubled on every retry, with jitter
+REQUEST_DEADLINE_SECONDS = 180  # Images of a request not analyzed by then are reported as failed
+INDEX_HTML_PATH = 'index.html'  # Served from memory at /
 API_VERSION = "2.0.0"
-API_TITLE = "Car Analyzer API"
\ No newline at end of file
+API_TITLE = "Car Analyzer API"
+
+# Adaptive multi-image analysis: stop once the car is pinned down
+ADAPTIVE_WAVE_SIZE = 2  # Images analyzed between stopping checks
+ADAPTIVE_CONFIDENCE_THRESHOLD = 0.7  # Mean per-image confidence needed to stop
+ADAPTIVE_MIN_AGREEMENT = 2  # Images that must agree on a field's value
+ADAPTIVE_STABLE_FIELDS = [
+    'vehicle_type', 'brand', 'model', 'year', 'body_condition', 'paint_condition'
+]
+
+# Startup warm-up: preload the model and run a tiny inference before /ready reports ready
+MODEL_WARMUP = True  # False reports ready as soon as the API is up
+WARMUP_RETRY_SECONDS = 5  # Delay between attempts while Ollama is unreachable
+
+# Image preprocessing before inference
+PREPROCESS_IMAGES = True
+PREPROCESS_MAX_EDGE = 672  # llava input resolution; larger images are downscaled
+PREPROCESS_JPEG_QUALITY = 85
+PREPROCESS_WORKERS = 2
+DUPLICATE_HASH_DISTANCE = 4  # Max differing perceptual-hash bits for a near-duplicate of the same focus area
+DUPLICATE_MIN_STDDEV = 8.0  # Flatter images (blank, dark, overexposed) only dedupe on identical bytes
+
+# Analysis result cache
+CACHE_MAX_ENTRIES = 1024
+CACHE_TTL_SECONDS = 7 * 24 * 3600
+CACHE_DB_PATH = None  # e.g. 'analysis_cache.sqlite3' to keep results across restarts
+CACHE_DB_MAX_ENTRIES = 50000  # Oldest rows beyond this are deleted from the sqlite tier
+CACHE_DB_PRUNE_EVERY = 100  # sqlite writes between removals of expired and excess rows
+
+# Analysis store: raw model outputs and analyses kept for later re-processing
+ANALYSIS_STORE_PATH = 'analyses.sqlite3'  # None disables the store
+REPROCESS_BATCH_SIZE = 1000
+
+# Batch valuation jobs
+JOBS_DB_PATH = 'jobs.sqlite3'
+JOBS_DATA_DIR = 'job_data'  # Extracted zip manifests
+BATCH_CONCURRENT_VEHICLES = 1  # Vehicles analyzed at once across all jobs
+BATCH_ALLOWED_ROOT = None  # Local directory that directory manifests may point into
+BATCH_LEASE_SECONDS = 60  # A claimed vehicle returns to the queue if its worker stops renewing the claim
+BATCH_DEADLINE_SECONDS = 30 * 60  # Per vehicle; batch calls wait behind interactive traffic, so far above REQUEST_DEADLINE_SECONDS
+BATCH_RETRY_SECONDS = 5  # Back-off before a vehicle that ran out of time is tried again
+MAX_BATCH_UPLOAD_SIZE = 2 * 1024 * 1024 * 1024
+MAX_MANIFEST_MEMBERS = 10000  # Entries a zip manifest may contain
+MAX_MANIFEST_EXTRACTED_SIZE = 4 * 1024 * 1024 * 1024  # Uncompressed bytes of all extracted images
@@ -0,0 +1,232 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+from types import MappingProxyType
+from config import (
+    BRAND_MULTIPLIERS, CONDITION_MULTIPLIERS, SEGMENT_BASE_PRICES, FOCUS_PROMPTS, CHARACTERISTIC_PATTERNS,
+    STRUCTURED_OUTPUT, STRUCTURED_SCHEMAS, CONFIG_OVERRIDES_PATH, CONFIG_RELOAD_POLL_SECONDS
+)
+
+# Tables that can be overridden from the config file, with their defaults from config.py
+RELOADABLE_TABLES = {
+    'brand_multipliers': BRAND_MULTIPLIERS,
+    'condition_multipliers': CONDITION_MULTIPLIERS,
+    'segment_base_prices': SEGMENT_BASE_PRICES,
+    'focus_prompts': FOCUS_PROMPTS,
+    'characteristic_patterns': CHARACTERISTIC_PATTERNS,
+}
+
+ConfigSnapshot = namedtuple('ConfigSnapshot', [
+    'version', 'generation', 'loaded_at', 'source',
+    'brand_multipliers', 'condition_multipliers', 'segment_base_prices', 'focus_prompts', 'characteristic_patterns',
+    'characteristic_parser', 'brand_index', 'prompts', 'prompt_digests'
+])
+
+class ConfigError(Exception):
+    """Raised when the config file cannot be turned into a snapshot"""
+
+class BrandIndex:
+    """Brand multiplier lookup memoized per raw brand string.
+
+    Keeps estimate_price_factors' semantics exactly: the brand is lowercased
+    and the first multiplier key (in table order) contained in it wins.
+    """
+
+    def __init__(self, multipliers=BRAND_MULTIPLIERS):
+        self._items = tuple(multipliers.items())
+        self._factors = {}
+
+    def factor(self, brand):
+        try:
+            return self._factors[brand]
+        except KeyError:
+            lowered = brand.lower()
+            factor = next((v for k, v in self._items if k in lowered), 1.0)
+            self._factors[brand] = factor
+            return factor
+
+def compile_characteristic_parser(patterns):
+    """Compile the label patterns into one line-anchored regex.
+
+    A line matches when it starts with a label, optionally behind list
+    markers, numbering or markdown emphasis, followed by ':' or '-'. Each
+    label group also swallows its separator, so match.lastgroup names the
+    field and the value is the rest of the match.
+    """
+    separator = r'\b[*_ \t]*[:-][*_ \t]*'
+    labels = '|'.join(
+        f"(?P<{key}>{re.sub(r'[ _]', '[ _]', label)}{separator})" for key, label in patterns.items()
+    )
+    return re.compile(
+        r'^[ \t>#*+-]*(?:\d+[.)][ \t]*)?[*_ \t]*(?:' + labels + r').*$',
+        re.IGNORECASE | re.MULTILINE
+    )
+
+def build_structured_prompt(schema):
+    """Compact prompt asking for a JSON object with the schema's keys"""
+    fields = json.dumps(schema, separators=(', ', ': '))
+    return (
+        "Analyze this car image for resale valuation. Respond with only a JSON object "
+        f"with exactly these keys and allowed values: {fields}. "
+        'Use "unknown" for anything not visible.'
+    )
+
+def _digest(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def _validate(tables):
+    for name in ('brand_multipliers', 'condition_multipliers', 'segment_base_prices'):
+        for key, value in tables[name].items():
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                raise ConfigError(f"{name}.{key} must be a number")
+    for name in ('focus_prompts', 'characteristic_patterns'):
+        if not all(isinstance(value, str) for value in tables[name].values()):
+            raise ConfigError(f"{name} values must be strings")
+    if 'general' not in tables['focus_prompts']:
+        raise ConfigError("focus_prompts must include 'general'")
+    for key in tables['characteristic_patterns']:
+        if not key.isidentifier():
+            raise ConfigError(f"characteristic_patterns key {key!r} must be a valid identifier")
+
+def build_snapshot(overrides=None, generation=0, source=None):
+    """Precompile an immutable snapshot from the defaults plus overridden tables"""
+    unknown = set(overrides or {}) - set(RELOADABLE_TABLES)
+    if unknown:
+        raise ConfigError(f"Unknown config tables: {', '.join(sorted(unknown))}")
+    tables = {name: dict((overrides or {}).get(name, default)) for name, default in RELOADABLE_TABLES.items()}
+    _validate(tables)
+
+    try:
+        parser = compile_characteristic_parser(tables['characteristic_patterns'])
+    except re.error as e:
+        raise ConfigError(f"Invalid characteristic pattern: {e}")
+
+    if STRUCTURED_OUTPUT:
+        prompts = {focus_area: build_structured_prompt(schema) for focus_area, schema in STRUCTURED_SCHEMAS.items()}
+    else:
+        prompts = dict(tables['focus_prompts'])
+
+    return ConfigSnapshot(
+        version=_digest(json.dumps(tables))[:12],  # table order matters for brand matching
+        generation=generation,
+        loaded_at=time.time(),
+        source=source,
+        characteristic_parser=parser,
+        brand_index=BrandIndex(tables['brand_multipliers']),
+        prompts=MappingProxyType(prompts),
+        prompt_digests=MappingProxyType({focus_area: _digest(prompt) for focus_area, prompt in prompts.items()}),
+        **{name: MappingProxyType(table) for name, table in tables.items()}
+    )
+
+def read_overrides(path):
+    """Tables from the JSON config file, {} when it does not exist"""
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            overrides = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ConfigError(f"Cannot read {path}: {e}")
+    if not isinstance(overrides, dict) or not all(isinstance(v, dict) for v in overrides.values()):
+        raise ConfigError(f"{path} must map table names to objects")
+    return overrides
+
+def _file_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except (OSError, TypeError):
+        return None
+
+_reload_lock = threading.Lock()
+_current = build_snapshot()
+_reload_stats = {'reloads': 0, 'failed_reloads': 0, 'reload_ms': None, 'last_error': None, 'file_mtime': None}
+_pinned = ContextVar('config_snapshot', default=None)
+
+def current_snapshot():
+    """The snapshot pinned to this request, or the latest one outside requests"""
+    return _pinned.get() or _current
+
+@contextmanager
+def pinned_snapshot():
+    """Keep using the current snapshot for everything inside the block, even across a reload"""
+    token = _pinned.set(_current)
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+def reload_config(path=CONFIG_OVERRIDES_PATH):
+    """Build a new snapshot from the config file and swap it in.
+
+    On error the previous snapshot stays active and ConfigError is raised.
+    """
+    global _current
+    with _reload_lock:
+        started = time.perf_counter()
+        mtime = _file_mtime(path)
+        try:
+            snapshot = build_snapshot(read_overrides(path), _current.generation + 1, path)
+        except ConfigError as e:
+            _reload_stats['failed_reloads'] += 1
+            _reload_stats['last_error'] = str(e)
+            _reload_stats['file_mtime'] = mtime
+            raise
+        _current = snapshot  # a single assignment, so readers see the old or the new snapshot
+        _reload_stats['reloads'] += 1
+        _reload_stats['reload_ms'] = round((time.perf_counter() - started) * 1000, 3)
+        _reload_stats['last_error'] = None
+        _reload_stats['file_mtime'] = mtime
+    return snapshot
+
+def reload_if_changed(path=CONFIG_OVERRIDES_PATH):
+    """Reload when the config file appeared, changed or disappeared since the last load"""
+    if _file_mtime(path) == _reload_stats['file_mtime']:
+        return False
+    try:
+        reload_config(path)
+    except ConfigError:
+        pass  # keep serving the previous snapshot; the error shows in config_info()
+    return True
+
+async def watch_config(path=CONFIG_OVERRIDES_PATH, interval=CONFIG_RELOAD_POLL_SECONDS):
+    """Poll the config file and reload it on change"""
+    while True:
+        await asyncio.to_thread(reload_if_changed, path)
+        await asyncio.sleep(interval)
+
+def config_info():
+    """Version, reload cost and errors of the active snapshot"""
+    snapshot = _current
+    return {
+        'version': snapshot.version,
+        'generation': snapshot.generation,
+        'loaded_at': snapshot.loaded_at,
+        'source': snapshot.source,
+        'reloads': _reload_stats['reloads'],
+        'failed_reloads': _reload_stats['failed_reloads'],
+        'reload_ms': _reload_stats['reload_ms'],
+        'last_error': _reload_stats['last_error'],
+        'tables': {name: len(getattr(snapshot, name)) for name in RELOADABLE_TABLES},
+    }
+
+class SnapshotMiddleware:
+    """Pin one config snapshot per request, so in-flight requests finish on the snapshot they started with"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        with pinned_snapshot():
+            await self.app(scope, receive, send)
+
+# Start from the config file when there is one
+reload_if_changed()
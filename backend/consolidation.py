@@ -0,0 +1,140 @@
+import re
+from functools import lru_cache
+
+# Bump when a change to normalization or voting should re-consolidate stored analyses
+CONSOLIDATION_VERSION = 1
+
+UNDETERMINED_VALUES = {"not specified", "unknown", "not visible", "not determined", ""}
+
+# A qualifier after the main value, e.g. "Good - minor scratches" or "fair (faded roof)"
+_QUALIFIER = re.compile(r'\s+[-–—]\s+|\s*[,;(]|\s+with\s+')
+_EDGE_PUNCTUATION = ' \t.,;:!?*"\'`'
+
+@lru_cache(maxsize=4096)
+def normalize_vote(value):
+    """Key a characteristic value votes under, None when it carries no information.
+
+    Case, surrounding punctuation and trailing qualifiers are dropped, so
+    "Good", "good." and "Good - minor scratches" are one vote for "good".
+    Model outputs repeat a small set of values, so keys are cached.
+    """
+    value = ' '.join(value.split()).strip(_EDGE_PUNCTUATION).lower()
+    key = _QUALIFIER.split(value, 1)[0].strip(_EDGE_PUNCTUATION)
+    if key in UNDETERMINED_VALUES or value in UNDETERMINED_VALUES:
+        return None
+    return key
+
+def _count_spelling(spellings, spelling, count, confidence):
+    stats = spellings.get(spelling)
+    if stats is None:
+        spellings[spelling] = [count, confidence]
+        return
+    stats[0] += count
+    stats[1] = max(stats[1], confidence)
+
+class ConsolidationAccumulator:
+    """Running per-field votes over the images of one car.
+
+    Each field maps normalized values to [votes, confidence-weighted votes,
+    spellings], where spellings maps each original spelling to [votes, best
+    confidence]. The winner of a field has the most weight, then the most
+    votes, then was seen first, and is shown in the spelling most of its
+    images used, so "Good" x3 beats one confident "Good - minor scratches"
+    and still matches the pricing tables. Adding an image costs O(fields),
+    two accumulators (e.g. of shards or waves) merge by adding their votes,
+    and to_dict() is plain JSON.
+    """
+
+    def __init__(self):
+        self.votes = {}
+        self.images = 0
+        self.confidence_sum = 0.0
+
+    @classmethod
+    def from_results(cls, results):
+        accumulator = cls()
+        for result in results:
+            accumulator.add(result)
+        return accumulator
+
+    def add(self, result):
+        """Count one ImageAnalysisResult"""
+        self.add_characteristics(result.characteristics, result.confidence_score)
+        return self
+
+    def add_characteristics(self, characteristics, confidence):
+        self.images += 1
+        self.confidence_sum += confidence
+        for field, value in characteristics.items():
+            field_votes = self.votes.setdefault(field, {})
+            key = normalize_vote(value)
+            if key is None:
+                continue
+            entry = field_votes.get(key)
+            if entry is None:
+                entry = field_votes[key] = [0, 0.0, {}]
+            entry[0] += 1
+            entry[1] += confidence
+            _count_spelling(entry[2], value.strip(), 1, confidence)
+
+    def merge(self, other):
+        """Add another accumulator's votes to this one"""
+        self.images += other.images
+        self.confidence_sum += other.confidence_sum
+        for field, other_votes in other.votes.items():
+            field_votes = self.votes.setdefault(field, {})
+            for key, (count, weight, spellings) in other_votes.items():
+                entry = field_votes.get(key)
+                if entry is None:
+                    entry = field_votes[key] = [0, 0.0, {}]
+                entry[0] += count
+                entry[1] += weight
+                for spelling, (spelling_count, best) in spellings.items():
+                    _count_spelling(entry[2], spelling, spelling_count, best)
+        return self
+
+    @property
+    def overall_confidence(self):
+        return self.confidence_sum / self.images if self.images else 0.0
+
+    def _winner(self, field):
+        field_votes = self.votes.get(field)
+        if not field_votes:
+            return None
+        # max() keeps the first of equal entries, i.e. the value seen first
+        return max(field_votes.values(), key=lambda entry: (entry[1], entry[0]))
+
+    def value(self, field):
+        winner = self._winner(field)
+        if winner is None:
+            return "Not determined"
+        # Most used spelling, then the most confident one; max() keeps the first seen of equals
+        return max(winner[2].items(), key=lambda item: (item[1][0], item[1][1]))[0]
+
+    def has_stable_majority(self, field, min_agreement):
+        """The winning value has min_agreement votes and more than half of the field's votes"""
+        winner = self._winner(field)
+        if winner is None:
+            return False
+        return winner[0] >= min_agreement and winner[0] * 2 > sum(entry[0] for entry in self.votes[field].values())
+
+    def result(self):
+        """(consolidated characteristics, mean confidence)"""
+        return {field: self.value(field) for field in self.votes}, self.overall_confidence
+
+    def to_dict(self):
+        return {'images': self.images, 'confidence_sum': self.confidence_sum, 'votes': self.votes}
+
+    @classmethod
+    def from_dict(cls, data):
+        accumulator = cls()
+        accumulator.images = data['images']
+        accumulator.confidence_sum = data['confidence_sum']
+        accumulator.votes = {
+            field: {
+                key: [count, weight, {spelling: list(stats) for spelling, stats in spellings.items()}]
+                for key, (count, weight, spellings) in field_votes.items()
+            }
+            for field, field_votes in data['votes'].items()
+        }
+        return accumulator
@@ -0,0 +1,425 @@
+import asyncio
+import csv
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import zipfile
+from collections import OrderedDict
+from config import (
+    JOBS_DB_PATH, JOBS_DATA_DIR, BATCH_CONCURRENT_VEHICLES, BATCH_ALLOWED_ROOT,
+    MAX_IMAGES_PER_REQUEST, MAX_FILE_SIZE, BATCH_LEASE_SECONDS, BATCH_DEADLINE_SECONDS, BATCH_RETRY_SECONDS, MAX_MANIFEST_MEMBERS, MAX_MANIFEST_EXTRACTED_SIZE
+)
+from config_snapshot import current_snapshot, pinned_snapshot
+from analyzer import (
+    analyze_car_images_concurrently, split_analyses, summarize_analyses, request_deadline, DeadlineExceededError
+)
+from preprocessing import preprocess_images
+from scheduler import QueueFullError
+from store import record_analysis
+from uploads import UploadedImage
+from utils import determine_focus_area
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+BATCH_REQUEST_ID = 'batch'  # All batch work shares one round-robin lane in the model scheduler
+
+class ManifestError(Exception):
+    """Raised when a batch manifest has no usable vehicle images"""
+
+def collect_vehicles(root_dir):
+    """Group the images under root_dir by vehicle, one sub-directory per vehicle.
+
+    Images directly in root_dir form a single vehicle named after the directory.
+    """
+    vehicles = OrderedDict()
+    for dirpath, dirnames, filenames in os.walk(root_dir):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith(('.', '__MACOSX')))
+        images = sorted(
+            os.path.join(dirpath, name) for name in filenames
+            if name.lower().endswith(IMAGE_EXTENSIONS) and not name.startswith('.')
+        )
+        if images:
+            vehicle_id = os.path.relpath(dirpath, root_dir)
+            if vehicle_id == '.':
+                vehicle_id = os.path.basename(os.path.normpath(root_dir))
+            vehicles[vehicle_id] = images[:MAX_IMAGES_PER_REQUEST]
+
+    if not vehicles:
+        raise ManifestError("Manifest contains no JPG, PNG or WebP images")
+    return vehicles
+
+def _is_image_member(member):
+    name = os.path.basename(member.filename)
+    return (
+        not member.is_dir() and name.lower().endswith(IMAGE_EXTENSIONS) and not name.startswith('.')
+        and not member.filename.startswith('__MACOSX')
+    )
+
+def _extract_member(archive, member, destination, max_bytes):
+    """Copy one member to disk, stopping at max_bytes whatever its header claims; returns the bytes written"""
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    written = 0
+    with archive.open(member) as source, open(destination, 'wb') as target:
+        while chunk := source.read(1024 * 1024):
+            written += len(chunk)
+            if written > max_bytes:
+                raise ManifestError(f"{member.filename} exceeds the per-image size limit")
+            target.write(chunk)
+    return written
+
+def extract_zip_manifest(zip_path, target_dir):
+    """Extract the images of a zip manifest.
+
+    Only image members are written. Paths escaping target_dir, too many
+    members, oversized images and a total beyond MAX_MANIFEST_EXTRACTED_SIZE
+    are refused before anything is extracted, and sizes are enforced again
+    while extracting since zip headers can lie.
+    """
+    target_dir = os.path.realpath(target_dir)
+    try:
+        with zipfile.ZipFile(zip_path) as archive:
+            members = archive.infolist()
+            if len(members) > MAX_MANIFEST_MEMBERS:
+                raise ManifestError(f"Manifest has more than {MAX_MANIFEST_MEMBERS} entries")
+            images = []
+            for member in members:
+                destination = os.path.realpath(os.path.join(target_dir, member.filename))
+                if not destination.startswith(target_dir + os.sep):
+                    raise ManifestError(f"Unsafe path in zip: {member.filename}")
+                if not _is_image_member(member):
+                    continue
+                if member.file_size > MAX_FILE_SIZE:
+                    raise ManifestError(f"{member.filename} exceeds the per-image size limit")
+                images.append((member, destination))
+            if sum(member.file_size for member, _ in images) > MAX_MANIFEST_EXTRACTED_SIZE:
+                raise ManifestError("Manifest images exceed the extracted size limit")
+
+            extracted = 0
+            for member, destination in images:
+                extracted += _extract_member(archive, member, destination, MAX_FILE_SIZE)
+                if extracted > MAX_MANIFEST_EXTRACTED_SIZE:
+                    raise ManifestError("Manifest images exceed the extracted size limit")
+    except zipfile.BadZipFile:
+        raise ManifestError("Manifest is not a valid zip file")
+    return collect_vehicles(target_dir)
+
+def resolve_directory_manifest(path):
+    """Validate a local directory manifest against BATCH_ALLOWED_ROOT"""
+    if not BATCH_ALLOWED_ROOT:
+        raise ManifestError("Directory manifests are disabled on this server")
+    allowed_root = os.path.realpath(BATCH_ALLOWED_ROOT)
+    directory = os.path.realpath(os.path.join(allowed_root, path))
+    if directory != allowed_root and not directory.startswith(allowed_root + os.sep):
+        raise ManifestError("Directory is outside the allowed batch root")
+    if not os.path.isdir(directory):
+        raise ManifestError(f"Directory not found: {path}")
+    return collect_vehicles(directory)
+
+class JobStore:
+    """sqlite persistence for batch jobs and their per-vehicle results.
+
+    Several API processes can share one database: a vehicle is claimed with
+    a lease held by this store's owner id, renewed while it is analyzed, and
+    any worker may take it over once the lease has expired.
+    """
+
+    def __init__(self, db_path=JOBS_DB_PATH, lease_seconds=BATCH_LEASE_SECONDS):
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self.lease_seconds = lease_seconds
+        self.owner = uuid.uuid4().hex
+        with self._lock:
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    source TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS vehicles (
+                    job_id TEXT NOT NULL,
+                    vehicle_id TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    image_paths TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    lease_owner TEXT,
+                    lease_expires_at REAL,
+                    PRIMARY KEY (job_id, vehicle_id)
+                );
+                CREATE INDEX IF NOT EXISTS vehicles_status ON vehicles (status, job_id, position);
+            """)
+
+    def create_job(self, source, vehicles):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, source, status, created_at, updated_at) VALUES (?, ?, 'queued', ?, ?)",
+                (job_id, source, now, now)
+            )
+            self._db.executemany(
+                "INSERT INTO vehicles (job_id, vehicle_id, position, image_paths, status) VALUES (?, ?, ?, ?, 'pending')",
+                [(job_id, vehicle_id, i, json.dumps(paths)) for i, (vehicle_id, paths) in enumerate(vehicles.items())]
+            )
+            self._db.commit()
+        return job_id
+
+    def get_job(self, job_id):
+        """Job status with per-state vehicle counts, or None"""
+        with self._lock:
+            job = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if job is None:
+                return None
+            counts = dict(self._db.execute(
+                "SELECT status, COUNT(*) FROM vehicles WHERE job_id = ? GROUP BY status", (job_id,)
+            ).fetchall())
+        return {
+            'job_id': job['id'],
+            'source': job['source'],
+            'status': job['status'],
+            'total_vehicles': sum(counts.values()),
+            'completed_vehicles': counts.get('done', 0),
+            'failed_vehicles': counts.get('failed', 0),
+            'pending_vehicles': counts.get('pending', 0) + counts.get('running', 0),
+            'created_at': job['created_at'],
+            'updated_at': job['updated_at']
+        }
+
+    def claim_next_vehicle(self):
+        """Lease the oldest pending (or abandoned) vehicle and return it, or None"""
+        with self._lock:
+            now = time.time()
+            # A single statement, so processes sharing the database cannot claim the same vehicle
+            row = self._db.execute(
+                "UPDATE vehicles SET status = 'running', lease_owner = ?, lease_expires_at = ? "
+                "WHERE rowid = (SELECT v.rowid FROM vehicles v JOIN jobs j ON j.id = v.job_id "
+                "WHERE v.status = 'pending' OR (v.status = 'running' AND COALESCE(v.lease_expires_at, 0) < ?) "
+                "ORDER BY j.created_at, v.position LIMIT 1) "
+                "RETURNING job_id, vehicle_id, image_paths",
+                (self.owner, now + self.lease_seconds, now)
+            ).fetchone()
+            if row is None:
+                self._db.commit()
+                return None
+            self._db.execute(
+                "UPDATE jobs SET status = 'running', updated_at = ? WHERE id = ?", (time.time(), row['job_id'])
+            )
+            self._db.commit()
+        return row['job_id'], row['vehicle_id'], json.loads(row['image_paths'])
+
+    def renew_lease(self, job_id, vehicle_id):
+        """Extend this worker's claim on a vehicle; False when the lease was lost to another worker"""
+        with self._lock:
+            renewed = self._db.execute(
+                "UPDATE vehicles SET lease_expires_at = ? WHERE job_id = ? AND vehicle_id = ? "
+                "AND status = 'running' AND lease_owner = ?",
+                (time.time() + self.lease_seconds, job_id, vehicle_id, self.owner)
+            ).rowcount
+            self._db.commit()
+        return bool(renewed)
+
+    def finish_vehicle(self, job_id, vehicle_id, result=None, error=None):
+        """Store a vehicle outcome and close the job once nothing is left"""
+        with self._lock:
+            self._db.execute(
+                "UPDATE vehicles SET status = ?, result = ?, error = ?, lease_owner = NULL, lease_expires_at = NULL "
+                "WHERE job_id = ? AND vehicle_id = ? AND lease_owner = ?",
+                ('failed' if error else 'done', json.dumps(result) if result else None, error,
+                 job_id, vehicle_id, self.owner)
+            )
+            remaining = self._db.execute(
+                "SELECT COUNT(*) FROM vehicles WHERE job_id = ? AND status IN ('pending', 'running')", (job_id,)
+            ).fetchone()[0]
+            self._db.execute(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE id = ?",
+                ('running' if remaining else 'completed', time.time(), job_id)
+            )
+            self._db.commit()
+
+    def release_vehicle(self, job_id, vehicle_id):
+        """Put a claimed vehicle back in the queue"""
+        with self._lock:
+            self._db.execute(
+                "UPDATE vehicles SET status = 'pending', lease_owner = NULL, lease_expires_at = NULL "
+                "WHERE job_id = ? AND vehicle_id = ? AND lease_owner = ?", (job_id, vehicle_id, self.owner)
+            )
+            self._db.commit()
+
+    def reset_interrupted(self):
+        """Requeue vehicles whose worker stopped without renewing its lease"""
+        with self._lock:
+            count = self._db.execute(
+                "UPDATE vehicles SET status = 'pending', lease_owner = NULL, lease_expires_at = NULL "
+                "WHERE status = 'running' AND COALESCE(lease_expires_at, 0) < ?", (time.time(),)
+            ).rowcount
+            self._db.commit()
+        return count
+
+    def iter_results(self, job_id):
+        """Per-vehicle result rows in manifest order"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT vehicle_id, image_paths, status, result, error FROM vehicles WHERE job_id = ? ORDER BY position",
+                (job_id,)
+            ).fetchall()
+        for row in rows:
+            result = json.loads(row['result']) if row['result'] else {}
+            yield {
+                'vehicle_id': row['vehicle_id'],
+                'status': row['status'],
+                'images': len(json.loads(row['image_paths'])),
+                'consolidated_characteristics': result.get('consolidated_characteristics'),
+                'price_estimation': result.get('price_estimation'),
+                'overall_confidence': result.get('overall_confidence'),
+                'analysis_id': result.get('analysis_id'),
+                'failed_images': result.get('failed_images', []),
+                'error': row['error']
+            }
+
+def results_as_jsonl(rows):
+    for row in rows:
+        yield json.dumps(row) + "\n"
+
+def results_as_csv(rows):
+    characteristic_keys = list(current_snapshot().characteristic_patterns)
+    price_keys = ['estimated_price', 'estimated_price_range', 'base_price', 'brand_factor', 'condition_factor']
+    header = ['vehicle_id', 'status', 'images', 'overall_confidence'] + characteristic_keys + price_keys + ['failed_images', 'error']
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for row in rows:
+        characteristics = row['consolidated_characteristics'] or {}
+        price = row['price_estimation'] or {}
+        writer.writerow(
+            [row['vehicle_id'], row['status'], row['images'], row['overall_confidence']]
+            + [characteristics.get(key, '') for key in characteristic_keys]
+            + [price.get(key, '') for key in price_keys]
+            + [';'.join(row['failed_images']), row['error'] or '']
+        )
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+def _load_vehicle_images(paths):
+    images = []
+    for i, path in enumerate(paths):
+        with open(path, 'rb') as f:
+            data = f.read(MAX_FILE_SIZE + 1)
+        if len(data) > MAX_FILE_SIZE:
+            raise ManifestError(f"{os.path.basename(path)} exceeds the per-image size limit")
+        name = os.path.basename(path)
+        images.append(UploadedImage(data, name, determine_focus_area(name, i), hashlib.sha256(data).hexdigest()))
+    return images
+
+class JobRunner:
+    """Background workers that analyze pending vehicles of all jobs"""
+
+    def __init__(self, store, workers=BATCH_CONCURRENT_VEHICLES):
+        self.store = store
+        self.workers = workers
+        self._wakeup = None
+        self._tasks = []
+
+    def start(self):
+        """Requeue interrupted vehicles and start the workers"""
+        self.store.reset_interrupted()
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        """Wake idle workers after new vehicles were queued"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _worker(self):
+        while True:
+            # sqlite work runs in a thread so a locked database never blocks the event loop
+            claimed = await asyncio.to_thread(self.store.claim_next_vehicle)
+            if claimed is None:
+                self._wakeup.clear()
+                try:
+                    # Wake up anyway to take over vehicles whose worker (maybe another process) died
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.store.lease_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            job_id, vehicle_id, paths = claimed
+            lease_keeper = asyncio.create_task(self._keep_lease(job_id, vehicle_id))
+            try:
+                with pinned_snapshot():
+                    result = await self._analyze_vehicle(paths)
+                await asyncio.to_thread(self.store.finish_vehicle, job_id, vehicle_id, result=result)
+            except QueueFullError as e:
+                # Interactive traffic has the queue; back off and try the vehicle again
+                await asyncio.to_thread(self.store.release_vehicle, job_id, vehicle_id)
+                await asyncio.sleep(e.retry_after)
+            except DeadlineExceededError:
+                # The vehicle waited behind interactive work; it is not broken, so it goes back in the queue
+                await asyncio.to_thread(self.store.release_vehicle, job_id, vehicle_id)
+                await asyncio.sleep(BATCH_RETRY_SECONDS)
+            except asyncio.CancelledError:
+                # Shutting down: release synchronously, the task cannot await any more
+                self.store.release_vehicle(job_id, vehicle_id)
+                raise
+            except Exception as e:
+                await asyncio.to_thread(self.store.finish_vehicle, job_id, vehicle_id, error=str(e))
+            finally:
+                lease_keeper.cancel()
+
+    async def _keep_lease(self, job_id, vehicle_id):
+        while True:
+            await asyncio.sleep(self.store.lease_seconds / 3)
+            await asyncio.to_thread(self.store.renew_lease, job_id, vehicle_id)
+
+    async def _analyze_vehicle(self, paths):
+        images = await asyncio.to_thread(_load_vehicle_images, paths)
+        images, duplicates, _ = await preprocess_images(images)
+        raw_analyses = await analyze_car_images_concurrently(
+            images, BATCH_REQUEST_ID, deadline=request_deadline(BATCH_DEADLINE_SECONDS)
+        )
+        analyzed_images, individual_analyses, errors = split_analyses(images, raw_analyses)
+        # A shed or timed-out call puts the whole vehicle back in the queue rather than pricing it
+        # from fewer images; the images that did finish come back from the cache on the next try
+        for _, error in errors:
+            if isinstance(error, (QueueFullError, DeadlineExceededError)):
+                raise error
+        if not individual_analyses:
+            raise errors[0][1]
+
+        consolidated_characteristics, price_estimation, analysis_summary = summarize_analyses(individual_analyses)
+        analysis_id = record_analysis(
+            'multi', analyzed_images, individual_analyses, consolidated_characteristics, price_estimation
+        )
+        return {
+            'analysis_id': analysis_id,
+            'consolidated_characteristics': consolidated_characteristics,
+            'price_estimation': price_estimation,
+            'overall_confidence': analysis_summary['overall_confidence'],
+            'duplicates_dropped': duplicates,
+            'failed_images': [image.name for image, _ in errors]
+        }
+
+def new_job_dir():
+    """Fresh directory under JOBS_DATA_DIR for an uploaded manifest"""
+    path = os.path.join(JOBS_DATA_DIR, uuid.uuid4().hex)
+    os.makedirs(path)
+    return path
+
+job_store = JobStore()
+job_runner = JobRunner(job_store)
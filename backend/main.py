@@ -1,20 +1,78 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
-import base64
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+import asyncio
+import json
+import os
+import shutil
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime
 from typing import List, Optional
+from pydantic import TypeAdapter, ValidationError
 import uvicorn
 
-from config import MAX_IMAGES_PER_REQUEST, API_VERSION, API_TITLE
-from models import ImageAnalysisResult, MultiImageAnalysisResponse, AnalysisResponse
+from config import (
+    MAX_IMAGES_PER_REQUEST, MAX_FILE_SIZE, MAX_REQUEST_UPLOAD_SIZE, MAX_BATCH_UPLOAD_SIZE,
+    IMAGES_PER_MODEL_CALL, API_VERSION, API_TITLE, CONFIG_OVERRIDES_PATH, INDEX_HTML_PATH, API_WORKERS
+)
+from config_snapshot import ConfigError, SnapshotMiddleware, config_info, reload_config, watch_config
+from models import (
+    MultiImageAnalysisResponse, AnalysisResponse,
+    ImageResultEvent, ImageErrorEvent, AnalysisCompleteEvent, AnalysisErrorEvent, JobStatusResponse,
+    ImageFailure, KnownImage, CacheLookupRequest, CacheLookupResponse
+)
 from analyzer import (
-    analyze_single_car_image, consolidate_multiple_analyses, 
-    generate_analysis_summary, estimate_price_factors
+    analyze_car_image_async, analyze_car_images_concurrently, analyze_car_images_as_completed,
+    analyze_car_images_adaptive, build_image_result, split_analyses, summarize_analyses,
+    partial_results_report, estimate_price_factors, request_deadline, DeadlineExceededError
+)
+from cache import analysis_cache, make_cache_key
+from consolidation import ConsolidationAccumulator
+from store import analysis_store, record_analysis, load_analysis, flush_writes
+from scheduler import model_scheduler, QueueFullError, ModelTimeoutError
+from model_client import model_pool
+from preprocessing import preprocess_images, shutdown_executor
+from metrics import (
+    stage, start_request_timings, register_component_gauges, render_metrics, REQUESTS_IN_FLIGHT
+)
+from jobs import (
+    job_store, job_runner, ManifestError, extract_zip_manifest, resolve_directory_manifest,
+    new_job_dir, results_as_jsonl, results_as_csv
 )
-from utils import parse_characteristics, calculate_confidence_score, determine_focus_area
+from uploads import (
+    UploadedImage, UploadBudget, UploadTooLargeError, RequestSizeLimitMiddleware, read_upload, record_request,
+    record_known_images, upload_stats, format_size
+)
+from utils import determine_focus_area
+from warmup import model_warmup
+from static_page import CachedPage
+
+index_page = CachedPage(INDEX_HTML_PATH)
+
+@asynccontextmanager
+async def lifespan(app):
+    # Serve right away; the model is loaded in the background and /ready flips once it answers
+    index_page.load()
+    model_pool.start()
+    model_warmup.start()
+    # Resume batch jobs interrupted by a restart
+    job_runner.start()
+    # Pick up edits to the config overrides file without a restart
+    config_watcher = asyncio.create_task(watch_config()) if CONFIG_OVERRIDES_PATH else None
+    yield
+    if config_watcher:
+        config_watcher.cancel()
+    await job_runner.stop()
+    await model_warmup.stop()
+    await model_pool.stop()
+    shutdown_executor()
+    flush_writes()
 
-app = FastAPI(title=API_TITLE, version=API_VERSION)
+app = FastAPI(title=API_TITLE, version=API_VERSION, lifespan=lifespan)
+
+# Refuse oversized bodies before they are parsed; inside CORS, so browsers can read the 413
+app.add_middleware(RequestSizeLimitMiddleware, limits={'/jobs': MAX_BATCH_UPLOAD_SIZE})
 
 # Enable CORS
 app.add_middleware(
@@ -25,114 +83,524 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+register_component_gauges(model_scheduler, analysis_cache, model_warmup)
+
+@app.middleware("http")
+async def track_requests_in_flight(request: Request, call_next):
+    endpoint = "analyze" if request.url.path.startswith("/analyze") else "other"
+    REQUESTS_IN_FLIGHT.labels(endpoint).inc()
+    try:
+        return await call_next(request)
+    finally:
+        REQUESTS_IN_FLIGHT.labels(endpoint).dec()
+
+# Outermost, so the whole request (including streamed bodies) sees one config snapshot
+app.add_middleware(SnapshotMiddleware)
+
+def queue_full_error(error):
+    """429 response telling the client when to retry"""
+    return HTTPException(status_code=429, detail=str(error), headers={"Retry-After": str(error.retry_after)})
+
+def all_images_failed_error(errors):
+    """Error response when no image could be analyzed: 429 when shed, 504 when out of time, else 500"""
+    for _, error in errors:
+        if isinstance(error, QueueFullError):
+            return queue_full_error(error)
+    if all(isinstance(error, (DeadlineExceededError, ModelTimeoutError)) for _, error in errors):
+        return HTTPException(status_code=504, detail=f"Multi-image analysis timed out: {errors[0][1]}")
+    return HTTPException(status_code=500, detail=f"Multi-image analysis failed: {errors[0][1]}")
+
+def image_failures(errors):
+    return [ImageFailure(image_name=image.name, error=str(error) or type(error).__name__) for image, error in errors]
+
+def validate_image_files(files, known_count=0):
+    """Reject empty, oversized or non-image multi-image uploads"""
+    if len(files) + known_count > MAX_IMAGES_PER_REQUEST:
+        raise HTTPException(status_code=400, detail=f"Maximum {MAX_IMAGES_PER_REQUEST} images allowed")
+    
+    if not files and not known_count:
+        raise HTTPException(status_code=400, detail="At least one image is required")
+    
+    for file in files:
+        if not file.content_type.startswith("image/"):
+            raise HTTPException(status_code=400, detail=f"File {file.filename} must be an image")
+
+async def read_upload_images(files):
+    """Read uploads in chunks into UploadedImage tuples, enforcing size limits"""
+    budget = UploadBudget()
+    images = []
+    try:
+        with stage('upload_read'):
+            for i, file in enumerate(files):
+                image_data, digest = await read_upload(file, budget)
+                
+                # Determine focus area based on filename or position
+                focus_area = determine_focus_area(file.filename, i)
+                images.append(UploadedImage(image_data, file.filename or f"image_{i+1}", focus_area, digest))
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    record_request(budget)
+    return images
+
+def known_image_cache_key(known, single=False):
+    """Cache key of a known image's result; /analyze uses the general focus for its one image"""
+    focus_area = "general" if single else determine_focus_area(known.filename, known.index)
+    return make_cache_key(known.sha256, focus_area)
+
+def parse_known_images(known_images):
+    """KnownImage entries from the known_images form field, a JSON list"""
+    if not known_images:
+        return []
+    try:
+        return TypeAdapter(List[KnownImage]).validate_json(known_images)
+    except ValidationError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid known_images: {e.errors()[0]['msg']}")
+
+async def single_known_image(known_image):
+    """UploadedImage, without data, for the image /analyze was given by hash; 409 when it left the cache"""
+    if not known_image:
+        raise HTTPException(status_code=400, detail="Upload an image file or name one in known_image")
+    try:
+        known = KnownImage.model_validate_json(known_image)
+    except ValidationError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid known_image: {e.errors()[0]['msg']}")
+    if not await analysis_cache.peek_async(known_image_cache_key(known, single=True)):
+        raise HTTPException(
+            status_code=409, detail={'message': "The image is no longer cached, upload it", 'missing': [known.sha256]}
+        )
+    record_known_images(1)
+    return UploadedImage(None, known.filename or "image", "general", known.sha256)
+
+async def merge_known_images(images, known):
+    """Put the images the client named by hash among the uploaded ones, in request order.
+
+    Known images carry no data and are served from the analysis cache. A
+    hash that is no longer cached answers 409 listing the missing hashes,
+    so the client uploads those images instead.
+    """
+    if not known:
+        return images
+    keys = [known_image_cache_key(image) for image in known]
+    cached = await analysis_cache.peek_many_async(keys)
+    missing = [image.sha256 for image, key in zip(known, keys) if key not in cached]
+    if missing:
+        raise HTTPException(
+            status_code=409, detail={'message': "Some images are no longer cached, upload them", 'missing': missing}
+        )
+    total = len(images) + len(known)
+    positions = {image.index: image for image in known}
+    if len(positions) != len(known) or not all(0 <= index < total for index in positions):
+        raise HTTPException(status_code=400, detail="known_images indexes must be distinct positions in the request")
+    record_known_images(len(known))
+    uploaded = iter(images)
+    merged = []
+    for index in range(total):
+        image = positions.get(index)
+        if image is None:
+            merged.append(next(uploaded))
+        else:
+            merged.append(UploadedImage(
+                None, image.filename or f"image_{index+1}", determine_focus_area(image.filename, index), image.sha256
+            ))
+    return merged
+
+def preprocessing_report(images_received, duplicates, preprocess_seconds, model_seconds):
+    """Preprocessing outcome and timing, kept apart from model time"""
+    return {
+        'images_received': images_received,
+        'duplicates_dropped': duplicates,
+        'preprocess_seconds': round(preprocess_seconds, 3),
+        'model_seconds': round(model_seconds, 3)
+    }
+
+def save_upload_to_disk(source, path, max_bytes):
+    """Copy an upload to disk in chunks, enforcing a size limit"""
+    written = 0
+    with open(path, 'wb') as target:
+        while chunk := source.read(1024 * 1024):
+            written += len(chunk)
+            if written > max_bytes:
+                raise UploadTooLargeError(f"Manifest exceeds the {format_size(max_bytes)} limit")
+            target.write(chunk)
+
+# The job store is sqlite behind a lock; its calls run in threads so a busy database never stalls the event loop
+async def queue_batch_job(source, vehicles):
+    job_id = await asyncio.to_thread(job_store.create_job, source, vehicles)
+    job_runner.notify()
+    return await asyncio.to_thread(job_store.get_job, job_id)
+
+async def get_job_or_404(job_id):
+    job = await asyncio.to_thread(job_store.get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
 @app.get("/")
-async def read_root():
-    with open("index.html", 'r', encoding='utf-8') as f:
-        html_content = f.read()
-    return HTMLResponse(content=html_content, status_code=200)
+async def read_root(request: Request):
+    response = index_page.response(
+        request.headers.get("if-none-match"), request.headers.get("accept-encoding", "")
+    )
+    if response is None:
+        raise HTTPException(status_code=404, detail="index.html not found")
+    return response
 
 @app.post("/analyze", response_model=AnalysisResponse)
-async def analyze_car(file: UploadFile = File(...)):
-    """Single image analysis (backward compatibility)"""
-    if not file.content_type.startswith("image/"):
+async def analyze_car(file: Optional[UploadFile] = File(None), known_image: Optional[str] = Form(None),
+                      debug: bool = False):
+    """Single image analysis (backward compatibility).
+
+    known_image names an already analyzed image by sha256 instead of
+    uploading it (see /cache/lookup with single set).
+    """
+    if file is not None and not file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="File must be an image")
     
+    timings = start_request_timings()
+    if file is None:
+        image = await single_known_image(known_image)
+    else:
+        budget = UploadBudget()
+        try:
+            with stage('upload_read'):
+                image_data, digest = await read_upload(file, budget)
+        except UploadTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        record_request(budget)
+        image = UploadedImage(image_data, file.filename, "general", digest)
+    
     try:
-        image_data = await file.read()
-        image_base64 = base64.b64encode(image_data).decode()
-        
-        raw_analysis = analyze_single_car_image(image_base64, file.filename)
-        characteristics = parse_characteristics(raw_analysis)
-        price_estimation = estimate_price_factors(characteristics)
+        with stage('preprocess'):
+            [image], _, _ = await preprocess_images([image], dedupe=False)
+        raw_analysis = await analyze_car_image_async(
+            image.data, image.name, digest=image.digest, deadline=request_deadline()
+        )
+        result = build_image_result(image.name, raw_analysis)
+        characteristics = result.characteristics
+        with stage('pricing'):
+            price_estimation = estimate_price_factors(characteristics)
+        analysis_id = record_analysis('single', [image], [result], characteristics, price_estimation)
         
         return AnalysisResponse(
+            analysis_id=analysis_id,
             characteristics=characteristics,
             price_estimation=price_estimation,
             raw_analysis=raw_analysis,
             analysis_date=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
             success=True,
-            message="Analysis completed successfully"
+            message="Analysis completed successfully",
+            timings=timings if debug else None
         )
         
+    except QueueFullError as e:
+        raise queue_full_error(e)
+    except (DeadlineExceededError, ModelTimeoutError) as e:
+        raise HTTPException(status_code=504, detail=f"Analysis timed out: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
 @app.post("/analyze-multiple", response_model=MultiImageAnalysisResponse)
 async def analyze_multiple_car_images(
-    files: List[UploadFile] = File(...),
-    analysis_focus: Optional[str] = Form("comprehensive")
+    files: List[UploadFile] = File([]),
+    analysis_focus: Optional[str] = Form("comprehensive"),
+    images_per_call: Optional[int] = Form(None),
+    adaptive: Optional[bool] = Form(False),
+    known_images: Optional[str] = Form(None),
+    debug: bool = False
 ):
-    """Analyze multiple images of the same car for comprehensive assessment"""
-    
-    if len(files) > MAX_IMAGES_PER_REQUEST:
-        raise HTTPException(status_code=400, detail=f"Maximum {MAX_IMAGES_PER_REQUEST} images allowed")
-    
-    if not files:
-        raise HTTPException(status_code=400, detail="At least one image is required")
-    
-    # Validate all files are images
-    for file in files:
-        if not file.content_type.startswith("image/"):
-            raise HTTPException(status_code=400, detail=f"File {file.filename} must be an image")
+    """Analyze multiple images of the same car for comprehensive assessment.
+
+    known_images names already analyzed images by sha256 instead of uploading
+    them (see /cache/lookup).
+    """
+    files = files or []
+    known = parse_known_images(known_images)
+    validate_image_files(files, len(known))
+    timings = start_request_timings()
+    images = await merge_known_images(await read_upload_images(files), known)
+    deadline = request_deadline()
     
     try:
-        individual_analyses = []
+        # Downscale and drop near-duplicate frames before they reach the model
+        with stage('preprocess'):
+            images, duplicates, preprocess_seconds = await preprocess_images(images)
         
-        for i, file in enumerate(files):
-            image_data = await file.read()
-            image_base64 = base64.b64encode(image_data).decode()
-            
-            # Determine focus area based on filename or position
-            focus_area = determine_focus_area(file.filename, i)
-            
-            # Analyze the image
-            raw_analysis = analyze_single_car_image(
-                image_base64, 
-                file.filename or f"image_{i+1}",
-                focus_area
+        model_started = time.perf_counter()
+        skipped = []
+        if adaptive:
+            # Stop sending images once the car is identified with confidence
+            analyzed_images, individual_analyses, errors, skipped, votes = await analyze_car_images_adaptive(
+                images, images_per_call=images_per_call or IMAGES_PER_MODEL_CALL, deadline=deadline
             )
-            
-            characteristics = parse_characteristics(raw_analysis)
-            confidence_score = calculate_confidence_score(characteristics)
-            
-            individual_analyses.append(ImageAnalysisResult(
-                image_name=file.filename or f"image_{i+1}",
-                characteristics=characteristics,
-                confidence_score=confidence_score,
-                analysis_notes=raw_analysis
-            ))
-        
-        # Consolidate all analyses
-        consolidated_characteristics, overall_confidence = consolidate_multiple_analyses(individual_analyses)
-        
-        # Generate price estimation based on consolidated data
-        price_estimation = estimate_price_factors(consolidated_characteristics)
+        else:
+            # Analyze the images concurrently, results come back in upload order
+            raw_analyses = await analyze_car_images_concurrently(
+                images, images_per_call=images_per_call or IMAGES_PER_MODEL_CALL, deadline=deadline
+            )
+            analyzed_images, individual_analyses, errors = split_analyses(images, raw_analyses)
+            votes = None
+        model_seconds = time.perf_counter() - model_started
+        # Images that failed or ran out of time are left out; only a total failure fails the request
+        if not individual_analyses:
+            raise all_images_failed_error(errors)
         
-        # Generate analysis summary
-        analysis_summary = generate_analysis_summary(
-            individual_analyses, 
-            consolidated_characteristics, 
-            overall_confidence
+        consolidated_characteristics, price_estimation, analysis_summary = summarize_analyses(individual_analyses, votes)
+        analysis_summary['preprocessing'] = preprocessing_report(len(images), duplicates, preprocess_seconds, model_seconds)
+        if errors:
+            analysis_summary['partial_results'] = partial_results_report(
+                analyzed_images, errors, analysis_summary['overall_confidence']
+            )
+        analysis_id = record_analysis(
+            'multi', analyzed_images, individual_analyses, consolidated_characteristics, price_estimation
         )
+        if adaptive:
+            analysis_summary['adaptive'] = {
+                'images_analyzed': len(individual_analyses),
+                'images_skipped': len(skipped),
+                'stopped_early': bool(skipped)
+            }
         
         return MultiImageAnalysisResponse(
+            analysis_id=analysis_id,
             consolidated_characteristics=consolidated_characteristics,
             price_estimation=price_estimation,
             individual_analyses=individual_analyses,
             analysis_summary=analysis_summary,
             analysis_date=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
             success=True,
-            message=f"Successfully analyzed {len(files)} images",
-            images_processed=len(files)
+            message=(
+                f"Analyzed {len(individual_analyses)} of {len(individual_analyses) + len(errors)} images"
+                if errors else f"Successfully analyzed {len(individual_analyses)} images"
+            ),
+            images_processed=len(individual_analyses),
+            skipped_images=[images[i].name for i in skipped],
+            failed_images=image_failures(errors),
+            timings=timings if debug else None
         )
         
+    except HTTPException:
+        raise
+    except QueueFullError as e:
+        raise queue_full_error(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Multi-image analysis failed: {str(e)}")
 
+@app.post("/analyze-multiple/stream")
+async def analyze_multiple_car_images_stream(
+    files: List[UploadFile] = File([]),
+    analysis_focus: Optional[str] = Form("comprehensive"),
+    images_per_call: Optional[int] = Form(None),
+    known_images: Optional[str] = Form(None),
+    debug: bool = False
+):
+    """Stream per-image results as newline-delimited JSON, then the consolidated result"""
+    files = files or []
+    known = parse_known_images(known_images)
+    validate_image_files(files, len(known))
+    timings = start_request_timings()
+    images = await merge_known_images(await read_upload_images(files), known)
+    deadline = request_deadline()
+    
+    async def event_stream():
+        try:
+            with stage('preprocess'):
+                kept_images, duplicates, preprocess_seconds = await preprocess_images(images)
+            individual_analyses = [None] * len(kept_images)
+            errors = [None] * len(kept_images)
+            # Votes are counted as results arrive, so the final consolidation does not start over
+            votes = ConsolidationAccumulator()
+            model_started = time.perf_counter()
+            
+            async for index, raw_analysis in analyze_car_images_as_completed(
+                kept_images, images_per_call=images_per_call or IMAGES_PER_MODEL_CALL, deadline=deadline
+            ):
+                if isinstance(raw_analysis, Exception):
+                    errors[index] = (kept_images[index], raw_analysis)
+                    [failure] = image_failures([errors[index]])
+                    yield ImageErrorEvent(index=index, failure=failure).model_dump_json() + "\n"
+                    continue
+                result = build_image_result(kept_images[index].name, raw_analysis)
+                individual_analyses[index] = result
+                votes.add(result)
+                yield ImageResultEvent(index=index, result=result).model_dump_json() + "\n"
+            
+            model_seconds = time.perf_counter() - model_started
+            analyzed_images = [image for image, result in zip(kept_images, individual_analyses) if result]
+            individual_analyses = [result for result in individual_analyses if result]
+            errors = [error for error in errors if error]
+            if not individual_analyses:
+                raise all_images_failed_error(errors)
+            consolidated_characteristics, price_estimation, analysis_summary = summarize_analyses(
+                individual_analyses, votes
+            )
+            analysis_summary['preprocessing'] = preprocessing_report(
+                len(images), duplicates, preprocess_seconds, model_seconds
+            )
+            if errors:
+                analysis_summary['partial_results'] = partial_results_report(
+                    analyzed_images, errors, analysis_summary['overall_confidence']
+                )
+            analysis_id = record_analysis(
+                'multi', analyzed_images, individual_analyses, consolidated_characteristics, price_estimation
+            )
+            yield AnalysisCompleteEvent(
+                analysis_id=analysis_id,
+                consolidated_characteristics=consolidated_characteristics,
+                price_estimation=price_estimation,
+                analysis_summary=analysis_summary,
+                analysis_date=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                images_processed=len(individual_analyses),
+                failed_images=image_failures(errors),
+                timings=timings if debug else None
+            ).model_dump_json() + "\n"
+        except HTTPException as e:
+            yield AnalysisErrorEvent(message=e.detail).model_dump_json() + "\n"
+        except Exception as e:
+            yield AnalysisErrorEvent(message=f"Multi-image analysis failed: {str(e)}").model_dump_json() + "\n"
+    
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+
+@app.post("/jobs", response_model=JobStatusResponse)
+async def create_batch_job(manifest: UploadFile = File(...)):
+    """Submit a zip manifest with one folder of images per vehicle"""
+    job_dir = new_job_dir()
+    zip_path = os.path.join(job_dir, "manifest.zip")
+    try:
+        await asyncio.to_thread(save_upload_to_disk, manifest.file, zip_path, MAX_BATCH_UPLOAD_SIZE)
+        vehicles = await asyncio.to_thread(extract_zip_manifest, zip_path, os.path.join(job_dir, "images"))
+    except ManifestError as e:
+        shutil.rmtree(job_dir, ignore_errors=True)
+        raise HTTPException(status_code=400, detail=str(e))
+    except UploadTooLargeError as e:
+        shutil.rmtree(job_dir, ignore_errors=True)
+        raise HTTPException(status_code=413, detail=str(e))
+    finally:
+        if os.path.exists(zip_path):
+            os.remove(zip_path)
+    
+    return await queue_batch_job(manifest.filename or "manifest.zip", vehicles)
+
+@app.post("/jobs/from-directory", response_model=JobStatusResponse)
+async def create_batch_job_from_directory(path: str = Form(...)):
+    """Submit a server-side directory with one sub-directory of images per vehicle"""
+    try:
+        vehicles = await asyncio.to_thread(resolve_directory_manifest, path)
+    except ManifestError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return await queue_batch_job(path, vehicles)
+
+@app.get("/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_batch_job(job_id: str):
+    return await get_job_or_404(job_id)
+
+@app.get("/jobs/{job_id}/events")
+async def stream_batch_job(job_id: str):
+    """Stream job progress as NDJSON until the job completes"""
+    await get_job_or_404(job_id)
+    
+    async def progress_stream():
+        last_seen = None
+        while True:
+            job = await asyncio.to_thread(job_store.get_job, job_id)
+            progress = (job['status'], job['completed_vehicles'], job['failed_vehicles'])
+            if progress != last_seen:
+                last_seen = progress
+                yield json.dumps(job) + "\n"
+            if job['status'] == 'completed':
+                break
+            await asyncio.sleep(1)
+    
+    return StreamingResponse(progress_stream(), media_type="application/x-ndjson")
+
+@app.get("/jobs/{job_id}/results")
+async def get_batch_job_results(job_id: str, format: str = "jsonl"):
+    """Download per-vehicle results as JSONL or CSV"""
+    await get_job_or_404(job_id)
+    rows = await asyncio.to_thread(lambda: list(job_store.iter_results(job_id)))
+    if format == "csv":
+        return StreamingResponse(
+            results_as_csv(rows), media_type="text/csv",
+            headers={"Content-Disposition": f'attachment; filename="{job_id}.csv"'}
+        )
+    if format == "jsonl":
+        return StreamingResponse(
+            results_as_jsonl(rows), media_type="application/x-ndjson",
+            headers={"Content-Disposition": f'attachment; filename="{job_id}.jsonl"'}
+        )
+    raise HTTPException(status_code=400, detail="format must be 'jsonl' or 'csv'")
+
+@app.get("/analyses/{analysis_id}")
+async def get_stored_analysis(analysis_id: str):
+    """A stored analysis with its current (possibly re-processed) results"""
+    analysis = await load_analysis(analysis_id)
+    if analysis is None:
+        raise HTTPException(status_code=404, detail="Analysis not found")
+    return analysis
+
+@app.post("/admin/reprocess")
+async def reprocess_stored_analyses(force: bool = False):
+    """Re-parse, re-consolidate and re-price stored analyses whose results are stale"""
+    if analysis_store is None:
+        raise HTTPException(status_code=404, detail="The analysis store is disabled")
+    # Analyses still queued for writing are re-processed too
+    await asyncio.to_thread(flush_writes)
+    return await asyncio.to_thread(analysis_store.reprocess, force)
+
+@app.get("/admin/config")
+async def get_config():
+    """Version and reload statistics of the active pricing tables, prompts and label patterns"""
+    return config_info()
+
+@app.post("/admin/reload-config")
+async def reload_configuration():
+    """Reload the config overrides file now instead of waiting for the watcher"""
+    try:
+        await asyncio.to_thread(reload_config)
+    except ConfigError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return config_info()
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy", "timestamp": datetime.now().isoformat()}
 
+@app.get("/ready")
+async def readiness_check():
+    """200 once the model is loaded and warmed up, 503 before; includes startup timings"""
+    readiness = model_warmup.stats()
+    return JSONResponse(content=readiness, status_code=200 if model_warmup.ready else 503)
+
+@app.post("/cache/lookup", response_model=CacheLookupResponse)
+async def lookup_cached_images(request: CacheLookupRequest):
+    """Which of these image hashes already have a cached analysis, so the client can skip uploading them"""
+    if len(request.images) > MAX_IMAGES_PER_REQUEST:
+        raise HTTPException(status_code=400, detail=f"Maximum {MAX_IMAGES_PER_REQUEST} images allowed")
+    if API_WORKERS > 1 and not analysis_cache.disk_enabled:
+        # The upload may reach another worker, whose in-memory cache does not have these results
+        return CacheLookupResponse(known=[])
+    keys = [known_image_cache_key(image, request.single) for image in request.images]
+    cached = await analysis_cache.peek_many_async(keys)
+    return CacheLookupResponse(known=[image.sha256 for image, key in zip(request.images, keys) if key in cached])
+
+@app.get("/cache-stats")
+async def cache_stats():
+    return analysis_cache.stats()
+
+@app.get("/queue-stats")
+async def queue_stats():
+    return model_scheduler.stats()
+
+@app.get("/model-backends")
+async def model_backends():
+    """Weight, health and load of each Ollama backend"""
+    return model_pool.stats()
+
+@app.get("/metrics")
+async def metrics():
+    content, media_type = render_metrics()
+    # Set the header directly, Response would append a second charset to media_type
+    return Response(content=content, headers={"Content-Type": media_type})
+
 @app.get("/api-info")
 async def api_info():
     return {
@@ -147,15 +615,39 @@ async def api_info():
         "endpoints": {
             "/analyze": "Single image analysis (legacy)",
             "/analyze-multiple": "Multiple images analysis (recommended)",
+            "/analyze-multiple/stream": "Multiple images analysis streamed as NDJSON events",
+            "/jobs": "Submit a batch valuation job (zip manifest)",
+            "/jobs/from-directory": "Submit a batch valuation job from a server-side directory",
+            "/jobs/{job_id}": "Batch job status",
+            "/jobs/{job_id}/events": "Batch job progress as NDJSON",
+            "/jobs/{job_id}/results": "Batch job results as JSONL or CSV",
             "/health": "API health check",
+            "/ready": "Readiness: 503 until the model is loaded and warmed up",
+            "/cache/lookup": "Which image hashes already have a cached analysis",
+            "/cache-stats": "Analysis result cache statistics",
+            "/queue-stats": "Model queue depth and wait times",
+            "/model-backends": "Health and load of each Ollama backend",
+            "/metrics": "Prometheus metrics (stage latencies, model timings, errors)",
+            "/analyses/{analysis_id}": "A stored analysis with its current results",
+            "/admin/reprocess": "Re-parse, re-consolidate and re-price stored analyses",
+            "/admin/config": "Version of the active pricing tables, prompts and label patterns",
+            "/admin/reload-config": "Reload the config overrides file",
             "/api-info": "API information"
         },
+        "cache": analysis_cache.stats(),
+        "uploads": upload_stats(),
         "limits": {
             "max_images_per_request": MAX_IMAGES_PER_REQUEST,
-            "max_file_size": "10MB per image",
+            "max_file_size": f"{format_size(MAX_FILE_SIZE)} per image",
+            "max_request_size": format_size(MAX_REQUEST_UPLOAD_SIZE),
             "supported_formats": ["JPG", "PNG", "WebP"]
         }
     }
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # Each worker process has its own model queue, caches and metrics; batch jobs are shared through sqlite
+    if API_WORKERS > 1:
+        # Workers need an import string, so each imports main again
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=API_WORKERS)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,115 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+STAGE_SECONDS = Histogram(
+    'car_analyzer_stage_seconds', 'Time spent in each analysis pipeline stage', ['stage'],
+    buckets=STAGE_BUCKETS
+)
+MODEL_QUEUE_WAIT_SECONDS = Histogram(
+    'car_analyzer_model_queue_wait_seconds', 'Time model jobs wait for a worker slot',
+    buckets=STAGE_BUCKETS
+)
+MODEL_PROMPT_EVAL_SECONDS = Histogram(
+    'car_analyzer_model_prompt_eval_seconds', 'Prompt processing time reported by Ollama',
+    buckets=STAGE_BUCKETS
+)
+MODEL_EVAL_SECONDS = Histogram(
+    'car_analyzer_model_eval_seconds', 'Generation time reported by Ollama', buckets=STAGE_BUCKETS
+)
+MODEL_LOAD_SECONDS = Histogram(
+    'car_analyzer_model_load_seconds', 'Model load time reported by Ollama', buckets=STAGE_BUCKETS
+)
+MODEL_TOKENS_PER_SECOND = Histogram(
+    'car_analyzer_model_tokens_per_second', 'Generation speed reported by Ollama',
+    buckets=(1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200)
+)
+MODEL_TOKENS = Counter('car_analyzer_model_tokens_total', 'Tokens processed by the model', ['kind'])
+MODEL_RETRIES = Counter('car_analyzer_model_retries_total', 'Model calls retried after a transient error', ['reason'])
+DEADLINES_EXCEEDED = Counter(
+    'car_analyzer_deadlines_exceeded_total', 'Model calls abandoned because the request deadline passed'
+)
+ANALYSIS_ERRORS = Counter('car_analyzer_analysis_errors_total', 'Failed model analyses', ['focus_area'])
+MODEL_BACKEND_REQUESTS = Counter(
+    'car_analyzer_model_backend_requests_total', 'Model calls per Ollama backend', ['host', 'outcome']
+)
+MODEL_BACKEND_OUTSTANDING = Gauge(
+    'car_analyzer_model_backend_outstanding', 'Model calls in flight per Ollama backend', ['host']
+)
+MODEL_BACKEND_HEALTHY = Gauge('car_analyzer_model_backend_healthy', 'Last health check result per Ollama backend', ['host'])
+REQUESTS_IN_FLIGHT = Gauge('car_analyzer_requests_in_flight', 'HTTP requests being served', ['endpoint'])
+
+_request_timings = ContextVar('request_timings', default=None)
+
+def start_request_timings():
+    """Collect stage timings for the current request and return the dict they go into"""
+    timings = {}
+    _request_timings.set(timings)
+    return timings
+
+def record_stage(name, seconds):
+    STAGE_SECONDS.labels(name).observe(seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        # Concurrent images add up, so this is time spent rather than wall-clock time
+        timings[name] = round(timings.get(name, 0.0) + seconds, 4)
+
+@contextmanager
+def stage(name):
+    """Time a pipeline stage into the histogram and the current request's breakdown"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+def record_model_response(response):
+    """Record the durations and token counts Ollama reports with each response"""
+    nanoseconds = 1e-9
+    if response.get('prompt_eval_duration'):
+        MODEL_PROMPT_EVAL_SECONDS.observe(response['prompt_eval_duration'] * nanoseconds)
+    if response.get('load_duration'):
+        MODEL_LOAD_SECONDS.observe(response['load_duration'] * nanoseconds)
+    if response.get('eval_duration'):
+        MODEL_EVAL_SECONDS.observe(response['eval_duration'] * nanoseconds)
+        if response.get('eval_count'):
+            MODEL_TOKENS_PER_SECOND.observe(response['eval_count'] / (response['eval_duration'] * nanoseconds))
+    if response.get('prompt_eval_count'):
+        MODEL_TOKENS.labels('prompt').inc(response['prompt_eval_count'])
+    if response.get('eval_count'):
+        MODEL_TOKENS.labels('generated').inc(response['eval_count'])
+    if response.get('total_duration'):
+        record_stage('model_inference', response['total_duration'] * nanoseconds)
+
+_component_gauges_registered = False
+
+def register_component_gauges(scheduler, cache, warmup=None):
+    """Expose scheduler, cache and readiness state as gauges read at scrape time.
+
+    Only the first call registers them: `python main.py` imports main a
+    second time as the app module, and the registry rejects duplicates.
+    """
+    global _component_gauges_registered
+    if _component_gauges_registered:
+        return
+    _component_gauges_registered = True
+    gauge = Gauge('car_analyzer_model_queue_depth', 'Model jobs waiting for a worker slot')
+    gauge.set_function(lambda: scheduler.stats()['queue_depth'])
+    gauge = Gauge('car_analyzer_model_busy_workers', 'Model worker slots in use')
+    gauge.set_function(lambda: scheduler.stats()['busy_workers'])
+    gauge = Gauge('car_analyzer_cache_hit_rate', 'Analysis cache hit rate')
+    gauge.set_function(lambda: cache.stats()['hit_rate'])
+    if warmup is not None:
+        gauge = Gauge('car_analyzer_ready', 'Whether the model is warmed up and the API reports ready')
+        gauge.set_function(lambda: float(warmup.ready))
+        gauge = Gauge('car_analyzer_time_to_ready_seconds', 'Seconds from process start until the API was ready')
+        gauge.set_function(lambda: warmup.stats()['time_to_ready_seconds'] or 0.0)
+        gauge = Gauge('car_analyzer_cold_start_seconds', 'Model load plus warm-up inference time at startup')
+        gauge.set_function(lambda: warmup.stats()['cold_start_seconds'] or 0.0)
+
+def render_metrics():
+    """Prometheus text exposition of all metrics"""
+    return generate_latest(), CONTENT_TYPE_LATEST
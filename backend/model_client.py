@@ -0,0 +1,185 @@
+import asyncio
+import itertools
+import time
+import httpx
+import ollama
+from config import (
+    MODEL_NAME, OLLAMA_HOSTS, OLLAMA_HEALTH_CHECK_SECONDS, OLLAMA_FAILURE_COOLDOWN_SECONDS
+)
+from metrics import MODEL_BACKEND_REQUESTS, MODEL_BACKEND_OUTSTANDING, MODEL_BACKEND_HEALTHY
+
+def parse_hosts(spec):
+    """[(host, weight)] from 'http://a:11434=2,http://b:11434'; [(None, 1)] (the default host) when empty"""
+    hosts = []
+    for entry in (spec or '').split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        host, _, weight = entry.rpartition('=') if '=' in entry else (entry, '', '1')
+        if float(weight) <= 0:
+            raise ValueError(f"Weight of {host} must be positive")
+        hosts.append((host, float(weight)))
+    return hosts or [(None, 1.0)]
+
+def is_backend_failure(error):
+    """Errors that say something about the backend rather than the request"""
+    if isinstance(error, httpx.TransportError):
+        return True
+    return isinstance(error, ollama.ResponseError) and error.status_code >= 500
+
+def has_model(tags, model=MODEL_NAME):
+    """Whether an /api/tags listing contains the model, with or without the ':latest' tag"""
+    names = {entry.get('name', '') for entry in tags.get('models', [])}
+    return model in names or (':' not in model and f"{model}:latest" in names)
+
+class OllamaBackend:
+    """One Ollama host with its weight, load and health"""
+
+    def __init__(self, host, weight=1.0):
+        self.host = host
+        self.label = host or 'default'
+        self.weight = weight
+        self.outstanding = 0
+        self.healthy = True
+        self.down_until = 0.0
+        self.last_error = None
+        self.last_checked = None
+        self.client = None
+        self.requests = 0
+        self.failures = 0
+
+    def available(self, now):
+        return self.healthy and now >= self.down_until
+
+    def load(self):
+        """Outstanding requests after one more, relative to the backend's weight"""
+        return (self.outstanding + 1) / self.weight
+
+    def mark_failed(self, error, cooldown):
+        self.down_until = time.monotonic() + cooldown
+        self.last_error = str(error)
+        self.failures += 1
+
+    def stats(self):
+        return {
+            'host': self.label,
+            'weight': self.weight,
+            'healthy': self.healthy and time.monotonic() >= self.down_until,
+            'outstanding': self.outstanding,
+            'last_error': self.last_error,
+            'last_checked': self.last_checked,
+            'requests': self.requests,
+            'failures': self.failures
+        }
+
+class OllamaPool:
+    """Routes model calls over several Ollama hosts.
+
+    Each call goes to the available backend with the fewest outstanding
+    requests per unit of weight. A backend that fails with a connection
+    error or a 5xx gets no traffic for a cooldown while the call fails over
+    to the next one; background health checks (/api/tags, which also shows
+    whether the model is pulled) take backends out and bring them back.
+    Every backend keeps one pooled async HTTP client per event loop.
+    """
+
+    def __init__(self, hosts=None, health_check_seconds=OLLAMA_HEALTH_CHECK_SECONDS,
+                 failure_cooldown=OLLAMA_FAILURE_COOLDOWN_SECONDS):
+        self.backends = [OllamaBackend(host, weight) for host, weight in (hosts or parse_hosts(OLLAMA_HOSTS))]
+        self.health_check_seconds = health_check_seconds
+        self.failure_cooldown = failure_cooldown
+        self._tie_breaker = itertools.count()
+        self._loop = None
+        self._health_task = None
+
+    def hosts(self):
+        return [backend.host for backend in self.backends]
+
+    def _ensure_clients(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # First use, or the previous event loop is gone (e.g. a test client restart)
+            self._loop = loop
+            for backend in self.backends:
+                backend.client = ollama.AsyncClient(host=backend.host)
+
+    def _candidates(self, backend_host=None):
+        """Backends to try in order: least loaded available ones first, then the rest as a last resort"""
+        if backend_host is not None or len(self.backends) == 1:
+            return [b for b in self.backends if backend_host is None or b.host == backend_host]
+        now = time.monotonic()
+        tie = next(self._tie_breaker)
+        order = lambda b: (not b.available(now), b.load(), (self.backends.index(b) - tie) % len(self.backends))
+        return sorted(self.backends, key=order)
+
+    async def chat(self, backend=None, **chat_kwargs):
+        """ollama.chat on the least loaded healthy backend, failing over on backend errors.
+
+        backend pins the call to one host, e.g. to preload the model everywhere.
+        """
+        self._ensure_clients()
+        candidates = self._candidates(backend)
+        if not candidates:
+            raise ValueError(f"Unknown Ollama backend: {backend}")
+
+        last_error = None
+        for candidate in candidates:
+            candidate.outstanding += 1
+            candidate.requests += 1
+            MODEL_BACKEND_OUTSTANDING.labels(candidate.label).inc()
+            try:
+                response = await candidate.client.chat(**chat_kwargs)
+            except Exception as e:
+                MODEL_BACKEND_REQUESTS.labels(candidate.label, 'error').inc()
+                if not is_backend_failure(e):
+                    raise
+                candidate.mark_failed(e, self.failure_cooldown)
+                last_error = e
+                continue
+            finally:
+                candidate.outstanding -= 1
+                MODEL_BACKEND_OUTSTANDING.labels(candidate.label).dec()
+            MODEL_BACKEND_REQUESTS.labels(candidate.label, 'ok').inc()
+            return response
+        raise last_error
+
+    async def check_health(self):
+        """Probe every backend's /api/tags and update its health"""
+        self._ensure_clients()
+
+        async def check(backend):
+            try:
+                tags = await backend.client.list()
+                backend.healthy = has_model(tags)
+                backend.last_error = None if backend.healthy else f"Model {MODEL_NAME} is not pulled"
+                if backend.healthy:
+                    backend.down_until = 0.0
+            except Exception as e:
+                backend.healthy = False
+                backend.last_error = str(e)
+            backend.last_checked = time.time()
+            MODEL_BACKEND_HEALTHY.labels(backend.label).set(float(backend.healthy))
+
+        await asyncio.gather(*(check(backend) for backend in self.backends))
+
+    def start(self):
+        """Run health checks in the background while there is more than one backend"""
+        if len(self.backends) > 1 and self.health_check_seconds:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def stop(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            await asyncio.gather(self._health_task, return_exceptions=True)
+            self._health_task = None
+
+    async def _health_loop(self):
+        while True:
+            await self.check_health()
+            await asyncio.sleep(self.health_check_seconds)
+
+    def stats(self):
+        """Per-backend weight, health, load and counters"""
+        return {'backends': [backend.stats() for backend in self.backends]}
+
+model_pool = OllamaPool()
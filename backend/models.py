@@ -1,13 +1,33 @@
-from pydantic import BaseModel
-from typing import Dict, Any, List
+from pydantic import BaseModel, Field
+from typing import Dict, Any, List, Literal, Optional
 
 class ImageAnalysisResult(BaseModel):
     image_name: str
     characteristics: Dict[str, str]
     confidence_score: float
     analysis_notes: str
+    # Set for sections of a grouped answer, whose prompt differs from the image's focus prompt
+    prompt_version: Optional[str] = Field(default=None, exclude=True)
+
+class KnownImage(BaseModel):
+    """An image the client hashed instead of uploading; index is its position among the request's images"""
+    sha256: str = Field(pattern=r'^[0-9a-f]{64}$')
+    filename: str = ""
+    index: int = 0
+
+class CacheLookupRequest(BaseModel):
+    images: List[KnownImage]
+    single: bool = False  # The image goes to /analyze, which analyzes it with the general focus
+
+class CacheLookupResponse(BaseModel):
+    known: List[str]
+
+class ImageFailure(BaseModel):
+    image_name: str
+    error: str
 
 class MultiImageAnalysisResponse(BaseModel):
+    analysis_id: Optional[str] = None
     consolidated_characteristics: Dict[str, str]
     price_estimation: Dict[str, Any]
     individual_analyses: List[ImageAnalysisResult]
@@ -16,11 +36,52 @@ class MultiImageAnalysisResponse(BaseModel):
     success: bool
     message: str
     images_processed: int
+    skipped_images: List[str] = []
+    failed_images: List[ImageFailure] = []
+    timings: Optional[Dict[str, float]] = None
 
 class AnalysisResponse(BaseModel):
+    analysis_id: Optional[str] = None
     characteristics: Dict[str, str]
     price_estimation: Dict[str, Any]
     raw_analysis: str
     analysis_date: str
     success: bool
-    message: str
\ No newline at end of file
+    message: str
+    timings: Optional[Dict[str, float]] = None
+
+class ImageResultEvent(BaseModel):
+    event: Literal["image"] = "image"
+    index: int
+    result: ImageAnalysisResult
+
+class ImageErrorEvent(BaseModel):
+    event: Literal["image_error"] = "image_error"
+    index: int
+    failure: ImageFailure
+
+class AnalysisCompleteEvent(BaseModel):
+    event: Literal["complete"] = "complete"
+    analysis_id: Optional[str] = None
+    consolidated_characteristics: Dict[str, str]
+    price_estimation: Dict[str, Any]
+    analysis_summary: Dict[str, Any]
+    analysis_date: str
+    images_processed: int
+    failed_images: List[ImageFailure] = []
+    timings: Optional[Dict[str, float]] = None
+
+class AnalysisErrorEvent(BaseModel):
+    event: Literal["error"] = "error"
+    message: str
+
+class JobStatusResponse(BaseModel):
+    job_id: str
+    source: str
+    status: str
+    total_vehicles: int
+    completed_vehicles: int
+    failed_vehicles: int
+    pending_vehicles: int
+    created_at: float
+    updated_at: float
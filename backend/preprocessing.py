@@ -0,0 +1,111 @@
+import asyncio
+import io
+import time
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageOps, ImageStat
+from config import (
+    PREPROCESS_IMAGES, PREPROCESS_MAX_EDGE, PREPROCESS_JPEG_QUALITY, PREPROCESS_WORKERS,
+    DUPLICATE_HASH_DISTANCE, DUPLICATE_MIN_STDDEV
+)
+from cache import analysis_cache, make_cache_key
+
+_executor = None
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=PREPROCESS_WORKERS)
+    return _executor
+
+def shutdown_executor():
+    """Stop the preprocessing processes; a uvicorn worker process cannot exit while they run"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
+
+def difference_hash(image, hash_size=8):
+    """64-bit perceptual hash comparing neighbouring pixels of a tiny grayscale thumbnail"""
+    pixels = list(image.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR).getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+def preprocess_image(image_data, max_edge=PREPROCESS_MAX_EDGE, quality=PREPROCESS_JPEG_QUALITY):
+    """Decode once, downscale to max_edge and re-encode as a metadata-free JPEG.
+
+    Returns (jpeg_bytes, perceptual_hash). Images Pillow cannot decode are
+    passed through unchanged with no hash, and nearly uniform images get no
+    hash either, since their hashes are noise that matches other flat frames.
+    """
+    try:
+        image = Image.open(io.BytesIO(image_data))
+        # Lets the JPEG decoder scale down during decode instead of after
+        image.draft('RGB', (max_edge, max_edge))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+        output = io.BytesIO()
+        # No exif argument, so EXIF/GPS metadata is dropped
+        image.save(output, 'JPEG', quality=quality, optimize=True)
+        if ImageStat.Stat(image.convert('L')).stddev[0] < DUPLICATE_MIN_STDDEV:
+            return output.getvalue(), None
+        return output.getvalue(), difference_hash(image)
+    except Exception:
+        return image_data, None
+
+async def preprocess_images(images, dedupe=True):
+    """Preprocess UploadedImage tuples in the process pool, dropping near-duplicates.
+
+    Images whose result is already cached skip preprocessing, since they will
+    not reach the model. Only images of the same focus area are compared:
+    identical uploads always dedupe, perceptually close ones only when they
+    carry a hash. Returns (kept_images, duplicates, seconds) where
+    duplicates lists {'image', 'duplicate_of'} entries.
+    """
+    started_at = time.perf_counter()
+    if not PREPROCESS_IMAGES:
+        return list(images), [], 0.0
+
+    loop = asyncio.get_running_loop()
+    executor = _get_executor()
+
+    keys = [make_cache_key(image.digest, image.focus_area) for image in images]
+    cached = await analysis_cache.peek_many_async(keys)
+
+    async def run(image, key):
+        if key in cached:
+            return image, None
+        processed, image_hash = await loop.run_in_executor(executor, preprocess_image, image.data)
+        return image._replace(data=processed), image_hash
+
+    prepared = await asyncio.gather(*(run(image, key) for image, key in zip(images, keys)))
+
+    kept = []
+    kept_digests = {}
+    kept_hashes = {}
+    duplicates = []
+    for image, image_hash in prepared:
+        if dedupe:
+            original = kept_digests.get((image.focus_area, image.digest))
+            if original is None and image_hash is not None:
+                original = next(
+                    (name for name, seen in kept_hashes.get(image.focus_area, [])
+                     if hamming_distance(image_hash, seen) <= DUPLICATE_HASH_DISTANCE),
+                    None
+                )
+            if original is not None:
+                duplicates.append({'image': image.name, 'duplicate_of': original})
+                continue
+            kept_digests[(image.focus_area, image.digest)] = image.name
+            if image_hash is not None:
+                kept_hashes.setdefault(image.focus_area, []).append((image.name, image_hash))
+        kept.append(image)
+
+    return kept, duplicates, time.perf_counter() - started_at
@@ -0,0 +1,149 @@
+import re
+from datetime import datetime
+import numpy as np
+from config_snapshot import current_snapshot
+
+# Bump when a change to the pricing rules (here, estimate_price_factors or the factor helpers)
+# should re-price stored analyses
+PRICING_VERSION = 1
+
+CONDITION_FIELDS = ['body_condition', 'paint_condition', 'interior_condition', 'wheel_condition']
+PRICE_FIELDS = ['brand', 'market_segment', 'year'] + CONDITION_FIELDS
+DEFAULT_BASE_PRICE = 20000
+DEFAULT_CONDITION_FACTOR = 0.8
+
+_YEAR = re.compile(r'(\d{4})')
+
+
+def _map_unique(values, func, dtype):
+    """Apply func once per distinct value and broadcast the results back"""
+    codes = {value: code for code, value in enumerate(dict.fromkeys(values))}
+    inverse = np.fromiter(map(codes.__getitem__, values), dtype=np.intp, count=len(values))
+    return np.array([func(value) for value in codes], dtype=dtype)[inverse]
+
+def _year_of(year_str):
+    if not isinstance(year_str, str):
+        return -1  # the scalar function swallows the TypeError and skips the age factor
+    match = _YEAR.search(year_str)
+    return int(match.group(1)) if match else -1
+
+def as_columns(records):
+    """Price input columns from a list of dicts, a dict of columns or a DataFrame"""
+    if hasattr(records, 'to_dict') and not isinstance(records, dict):
+        records = records.to_dict('list')  # pandas DataFrame
+    if isinstance(records, dict):
+        size = len(next(iter(records.values()), []))
+        return {field: list(records[field]) if field in records else [''] * size for field in PRICE_FIELDS}
+    return {field: [record.get(field, '') for record in records] for field in PRICE_FIELDS}
+
+def price_arrays(records, snapshot=None, current_year=None):
+    """Base, brand, condition and age factors plus estimated prices as NumPy arrays"""
+    snapshot = snapshot or current_snapshot()
+    columns = as_columns(records)
+    current_year = current_year or datetime.now().year
+
+    brand_factor = _map_unique(columns['brand'], snapshot.brand_index.factor, float)
+    base_price = _map_unique(
+        columns['market_segment'],
+        lambda segment: snapshot.segment_base_prices.get(segment.lower(), DEFAULT_BASE_PRICE), np.int64
+    )
+
+    # Worst (lowest) recognised condition, inf where a field carries no grade
+    condition = np.full(len(base_price), np.inf)
+    for field in CONDITION_FIELDS:
+        factors = _map_unique(columns[field], lambda c: snapshot.condition_multipliers.get(c.lower(), np.inf), float)
+        condition = np.minimum(condition, factors)
+    condition_factor = np.where(np.isinf(condition), DEFAULT_CONDITION_FACTOR, condition)
+
+    # Same operation order as the scalar function so results match bit for bit
+    estimated_price = base_price * brand_factor * condition_factor
+    year = _map_unique(columns['year'], _year_of, np.int64)
+    has_year = year >= 0
+    age_factor = np.maximum(0.3, 1.0 - (current_year - year) * 0.05)
+    estimated_price = np.where(has_year, estimated_price * age_factor, estimated_price)
+
+    return {
+        'estimated_price': estimated_price,
+        'base_price': base_price,
+        'brand_factor': brand_factor,
+        'condition_factor': condition_factor,
+        'age_factor': np.where(has_year, age_factor, 1.0),
+    }
+
+def _flags(values, word, as_str=False):
+    """Per-record 'word in value.lower()' with one check per distinct value"""
+    if as_str:
+        return _map_unique(values, lambda value: word in str(value).lower(), bool)
+    return _map_unique(values, lambda value: word in value.lower(), bool)
+
+def _combinations(texts):
+    """Factor lists for every on/off combination of texts, indexed by bit pattern"""
+    return [tuple(text for bit, text in enumerate(texts) if code >> bit & 1) for code in range(2 ** len(texts))]
+
+_POSITIVE_FACTORS = _combinations(["Luxury vehicle segment", "Excellent body condition", "Low estimated mileage"])
+_NEGATIVE_FACTORS = _combinations(["Poor body condition", "Visible damage present", "High estimated mileage"])
+_RECOMMENDATIONS = _combinations([
+    "Consider professional inspection before purchase", "Check if modifications affect warranty or insurance"
+])
+
+def explain_prices_bulk(records):
+    """get_positive_factors, get_negative_factors and get_price_recommendations for many records"""
+    segment = [record.get('market_segment', '') for record in records]
+    body = [record.get('body_condition', '') for record in records]
+    mileage = [record.get('mileage_category', '') for record in records]
+    damage = [record.get('damage', '') for record in records]
+
+    positive = _flags(segment, 'luxury') | _flags(body, 'excellent') << 1 | _flags(mileage, 'low') << 2
+    negative = _flags(body, 'poor', True) | _flags(damage, 'damaged', True) << 1 | _flags(mileage, 'high') << 2
+    # '\0' cannot occur in a value, so 'poor' can only match inside one of them
+    any_poor = np.fromiter(
+        ('poor' in '\0'.join(map(str, record.values())).lower() for record in records), dtype=bool, count=len(records)
+    )
+    modified = np.fromiter(
+        ('modifications' in record and record['modifications'] != 'Not specified' for record in records),
+        dtype=bool, count=len(records)
+    )
+    recommendations = any_poor | modified << 1
+
+    return [
+        {
+            'positive_factors': list(_POSITIVE_FACTORS[p]),
+            'negative_factors': list(_NEGATIVE_FACTORS[n]),
+            'recommendations': list(_RECOMMENDATIONS[r])
+        }
+        for p, n, r in zip(positive.tolist(), negative.tolist(), recommendations.tolist())
+    ]
+
+def estimate_prices_bulk(records, explain=True, snapshot=None):
+    """estimate_price_factors for many characteristics records at once.
+
+    Accepts a list of characteristics dicts, a dict of columns or a pandas
+    DataFrame and returns the same dicts the scalar function would. With
+    explain=False the per-record factor explanations are left out.
+    """
+    if hasattr(records, 'to_dict') and not isinstance(records, dict):
+        records = records.to_dict('records')
+    elif isinstance(records, dict):
+        records = [dict(zip(records, row)) for row in zip(*records.values())]
+    arrays = price_arrays(records, snapshot)
+    explanations = explain_prices_bulk(records) if explain else [None] * len(records)
+
+    results = []
+    for explanation, estimated_price, base_price, brand_factor, condition_factor in zip(
+        explanations,
+        arrays['estimated_price'].tolist(),
+        arrays['base_price'].tolist(),
+        arrays['brand_factor'].tolist(),
+        arrays['condition_factor'].tolist()
+    ):
+        result = {
+            'estimated_price_range': f"${estimated_price*0.8:,.0f} - ${estimated_price*1.2:,.0f}",
+            'estimated_price': int(estimated_price),
+            'base_price': base_price,
+            'brand_factor': brand_factor,
+            'condition_factor': condition_factor
+        }
+        if explain:
+            result['factors_explanation'] = explanation
+        results.append(result)
+    return results
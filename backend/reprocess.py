@@ -0,0 +1,29 @@
+"""Re-parse, re-consolidate and re-price stored analyses without running the model.
+
+Only results made stale by a change to the parser, the consolidation rule or
+the pricing tables are redone. Run from the backend directory:
+
+    python reprocess.py            # incremental
+    python reprocess.py --force    # redo everything
+"""
+import argparse
+import json
+import sys
+
+from config import ANALYSIS_STORE_PATH, REPROCESS_BATCH_SIZE
+from store import AnalysisStore
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', default=ANALYSIS_STORE_PATH, help='analysis store sqlite file')
+    parser.add_argument('--force', action='store_true', help='redo every record, not just stale ones')
+    parser.add_argument('--batch-size', type=int, default=REPROCESS_BATCH_SIZE)
+    args = parser.parse_args()
+
+    if not args.db:
+        sys.exit("The analysis store is disabled (ANALYSIS_STORE_PATH is None)")
+    store = AnalysisStore(args.db)
+    print(json.dumps(store.reprocess(args.force, args.batch_size), indent=2))
+
+if __name__ == '__main__':
+    main()
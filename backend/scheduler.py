@@ -0,0 +1,151 @@
+import asyncio
+import inspect
+import math
+import time
+from collections import OrderedDict, deque
+from config import MODEL_WORKER_SLOTS, MAX_QUEUED_MODEL_JOBS, MODEL_CALL_TIMEOUT_SECONDS
+from metrics import MODEL_QUEUE_WAIT_SECONDS
+from model_client import model_pool
+
+class QueueFullError(Exception):
+    """Raised when the model queue cannot admit another job"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Model queue is full, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+class ModelTimeoutError(Exception):
+    """Raised when a model call runs longer than the per-call timeout"""
+
+    def __init__(self, timeout):
+        super().__init__(f"Model call timed out after {timeout}s")
+        self.timeout = timeout
+
+class ModelScheduler:
+    """Fixed pool of model worker slots fed by per-request queues.
+
+    Requests are served round-robin, one job at a time, so a large upload
+    cannot starve single-image callers. The model client is any callable
+    (sync or async) taking ollama.chat keyword arguments, which lets tests
+    inject a fake in place of Ollama; by default it is the pool of Ollama
+    backends, with MODEL_WORKER_SLOTS slots per backend. A call that runs
+    past call_timeout, or whose caller gave up, is cancelled so a hung
+    model cannot hold a slot.
+    """
+
+    def __init__(self, workers=None, max_queue_depth=MAX_QUEUED_MODEL_JOBS, model_client=None,
+                 call_timeout=MODEL_CALL_TIMEOUT_SECONDS):
+        self.workers = workers or MODEL_WORKER_SLOTS * len(model_pool.backends)
+        self.max_queue_depth = max_queue_depth
+        self.model_client = model_client or model_pool.chat
+        self.call_timeout = call_timeout
+        self._queues = OrderedDict()  # request_id -> deque of (future, chat_kwargs, enqueued_at)
+        self._depth = 0
+        self._busy = 0
+        self._loop = None
+        self._condition = None
+        self._worker_tasks = []
+        self._waits = deque(maxlen=100)
+        self._service_times = deque(maxlen=100)
+        self._counters = {'completed': 0, 'failed': 0, 'rejected': 0, 'timed_out': 0, 'abandoned': 0}
+
+    def set_model_client(self, model_client):
+        """Swap the model client, e.g. for a fake in tests"""
+        self.model_client = model_client
+
+    async def submit(self, request_id, **chat_kwargs):
+        """Queue a model call for request_id and wait for its response"""
+        self._ensure_started()
+        if self._depth >= self.max_queue_depth:
+            self._counters['rejected'] += 1
+            raise QueueFullError(self._retry_after())
+
+        future = self._loop.create_future()
+        async with self._condition:
+            self._queues.setdefault(request_id, deque()).append((future, chat_kwargs, time.monotonic()))
+            self._depth += 1
+            self._condition.notify()
+        return await future
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        # First use, or the previous event loop is gone (e.g. a test client restart)
+        self._loop = loop
+        self._condition = asyncio.Condition()
+        self._queues.clear()
+        self._depth = 0
+        self._busy = 0
+        self._worker_tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def _next_job(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._depth > 0)
+            request_id, queue = next(iter(self._queues.items()))
+            job = queue.popleft()
+            self._depth -= 1
+            if queue:
+                self._queues.move_to_end(request_id)
+            else:
+                del self._queues[request_id]
+            return job
+
+    async def _worker(self):
+        while True:
+            future, chat_kwargs, enqueued_at = await self._next_job()
+            if future.done():
+                continue  # caller gave up while queued
+
+            started_at = time.monotonic()
+            self._waits.append(started_at - enqueued_at)
+            MODEL_QUEUE_WAIT_SECONDS.observe(started_at - enqueued_at)
+            self._busy += 1
+            call = asyncio.ensure_future(self._call(chat_kwargs))
+            # The caller gave up (deadline, disconnect): stop the model call too
+            future.add_done_callback(lambda done, call=call: call.cancel() if done.cancelled() else None)
+            try:
+                response = await asyncio.wait_for(call, self.call_timeout)
+                if not future.done():
+                    future.set_result(response)
+                self._counters['completed'] += 1
+            except asyncio.TimeoutError:
+                if not future.done():
+                    future.set_exception(ModelTimeoutError(self.call_timeout))
+                self._counters['timed_out'] += 1
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise  # the worker itself is being stopped
+                self._counters['abandoned'] += 1
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                self._counters['failed'] += 1
+            finally:
+                self._busy -= 1
+                self._service_times.append(time.monotonic() - started_at)
+
+    async def _call(self, chat_kwargs):
+        if inspect.iscoroutinefunction(self.model_client):
+            return await self.model_client(**chat_kwargs)
+        return await asyncio.to_thread(self.model_client, **chat_kwargs)
+
+    def _retry_after(self):
+        average_service = (sum(self._service_times) / len(self._service_times)) if self._service_times else 1.0
+        return max(1, math.ceil(self._depth / self.workers * average_service))
+
+    def stats(self):
+        """Queue depth, worker usage and wait times"""
+        waits = list(self._waits)
+        return {
+            'workers': self.workers,
+            'busy_workers': self._busy,
+            'queue_depth': self._depth,
+            'max_queue_depth': self.max_queue_depth,
+            'queued_requests': len(self._queues),
+            'average_wait_seconds': round(sum(waits) / len(waits), 3) if waits else 0.0,
+            'max_wait_seconds': round(max(waits), 3) if waits else 0.0,
+            **self._counters
+        }
+
+model_scheduler = ModelScheduler()
@@ -0,0 +1,42 @@
+import gzip
+import hashlib
+from fastapi.responses import Response
+
+class CachedPage:
+    """A static page read once and served from memory.
+
+    Responses carry an ETag, so browsers revalidate with If-None-Match and
+    get a bodiless 304, and a precompressed gzip body for clients that
+    accept it. The file is read on first use; restart to pick up edits.
+    """
+
+    def __init__(self, path, media_type='text/html; charset=utf-8'):
+        self.path = path
+        self.media_type = media_type
+        self._body = None
+        self._gzip_body = None
+        self._etag = None
+
+    def load(self):
+        """Read and compress the file; False when it does not exist"""
+        try:
+            with open(self.path, 'rb') as f:
+                body = f.read()
+        except FileNotFoundError:
+            return False
+        self._gzip_body = gzip.compress(body, compresslevel=9, mtime=0)
+        self._etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+        self._body = body
+        return True
+
+    def response(self, if_none_match=None, accept_encoding=''):
+        """Response for the page, None when the file is missing"""
+        if self._body is None and not self.load():
+            return None
+        headers = {'ETag': self._etag, 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+        if if_none_match and self._etag in (tag.strip() for tag in if_none_match.split(',')):
+            return Response(status_code=304, headers=headers)
+        if 'gzip' in accept_encoding:
+            headers['Content-Encoding'] = 'gzip'
+            return Response(content=self._gzip_body, headers={**headers, 'Content-Type': self.media_type})
+        return Response(content=self._body, headers={**headers, 'Content-Type': self.media_type})
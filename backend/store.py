@@ -0,0 +1,372 @@
+import asyncio
+import contextvars
+import hashlib
+import json
+import sqlite3
+import statistics
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from config import MODEL_NAME, ANALYSIS_STORE_PATH, REPROCESS_BATCH_SIZE, STRUCTURED_SCHEMAS
+import analyzer
+from config_snapshot import current_snapshot, pinned_snapshot
+from models import ImageAnalysisResult
+from consolidation import CONSOLIDATION_VERSION
+from pricing import PRICING_VERSION, estimate_prices_bulk
+import utils
+from utils import PARSER_VERSION
+
+def _digest(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+_component_versions = {}
+
+def component_versions(snapshot=None):
+    """Digests of the code version and tables behind each post-processing step.
+
+    A stored result is stale when the digest it was computed with differs
+    from the current one, so editing the label patterns or a pricing table,
+    or bumping PARSER_VERSION, CONSOLIDATION_VERSION or PRICING_VERSION,
+    marks exactly that step for redoing.
+    """
+    snapshot = snapshot or current_snapshot()
+    versions = _component_versions.get(snapshot.version)
+    if versions is None:
+        versions = _component_versions[snapshot.version] = {
+            'parser': _digest(PARSER_VERSION, list(snapshot.characteristic_patterns.items()), STRUCTURED_SCHEMAS),
+            'consolidation': _digest(CONSOLIDATION_VERSION),
+            'pricing': _digest(
+                PRICING_VERSION, list(snapshot.brand_multipliers.items()), dict(snapshot.condition_multipliers),
+                dict(snapshot.segment_base_prices)
+            ),
+        }
+    return versions
+
+def prompt_version(focus_area):
+    """Short digest of the prompt an image's output was produced with"""
+    prompt_digests = current_snapshot().prompt_digests
+    return prompt_digests.get(focus_area, prompt_digests['general'])[:12]
+
+def _output_digest(raw_output):
+    return hashlib.sha256(raw_output.encode('utf-8')).hexdigest()[:16]
+
+def _dumps(value):
+    return json.dumps(value, separators=(',', ':'))
+
+class AnalysisStore:
+    """sqlite record of raw model outputs and the analyses built from them.
+
+    Raw outputs are kept zlib-compressed, one row per image hash, focus area,
+    model, prompt version and distinct answer, so a rerun never overwrites
+    the output an earlier analysis points to, and parsing, consolidation and
+    pricing can be redone later without running the model again.
+    """
+
+    def __init__(self, db_path=ANALYSIS_STORE_PATH):
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS model_outputs (
+                    id INTEGER PRIMARY KEY,
+                    image_hash TEXT NOT NULL,
+                    focus_area TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    prompt_version TEXT NOT NULL,
+                    output_digest TEXT NOT NULL,
+                    raw_output BLOB NOT NULL,
+                    created_at REAL NOT NULL,
+                    UNIQUE (image_hash, focus_area, model, prompt_version, output_digest)
+                );
+                CREATE TABLE IF NOT EXISTS parsed_outputs (
+                    output_id INTEGER PRIMARY KEY,
+                    parser_version TEXT NOT NULL,
+                    characteristics TEXT NOT NULL,
+                    confidence REAL NOT NULL,
+                    changed_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS analyses (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    consolidated TEXT NOT NULL,
+                    overall_confidence REAL NOT NULL,
+                    consolidation_version TEXT NOT NULL,
+                    consolidated_at REAL NOT NULL,
+                    price TEXT NOT NULL,
+                    pricing_version TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS analysis_images (
+                    analysis_id TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    output_id INTEGER NOT NULL,
+                    image_name TEXT NOT NULL,
+                    PRIMARY KEY (analysis_id, position)
+                );
+                CREATE INDEX IF NOT EXISTS analysis_images_output ON analysis_images (output_id);
+            """)
+
+    def record_analysis(self, kind, images, results, consolidated, overall_confidence, price_estimation,
+                        analysis_id=None):
+        """Store one analysis with the raw output behind each of its images, returns its id.
+
+        kind is 'single' (characteristics of one image priced directly) or
+        'multi' (consolidated over images). results are the ImageAnalysisResult
+        objects for images, whose analysis_notes hold the raw model output.
+        """
+        analysis_id = analysis_id or uuid.uuid4().hex
+        versions = component_versions()
+        now = time.time()
+        with self._lock:
+            output_ids = [
+                self._save_output(image, result, versions['parser'], now) for image, result in zip(images, results)
+            ]
+            self._db.execute(
+                "INSERT INTO analyses (id, kind, created_at, consolidated, overall_confidence, consolidation_version, "
+                "consolidated_at, price, pricing_version) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (analysis_id, kind, now, _dumps(consolidated), overall_confidence, versions['consolidation'],
+                 time.time(), _dumps(price_estimation), versions['pricing'])
+            )
+            self._db.executemany(
+                "INSERT INTO analysis_images (analysis_id, position, output_id, image_name) VALUES (?, ?, ?, ?)",
+                [(analysis_id, i, output_id, image.name) for i, (image, output_id) in enumerate(zip(images, output_ids))]
+            )
+            self._db.commit()
+        return analysis_id
+
+    def _save_output(self, image, result, parser_version, now):
+        # The same answer (e.g. served from the cache) shares a row; a different one gets its own
+        raw_output = result.analysis_notes
+        output_id = self._db.execute(
+            "INSERT INTO model_outputs (image_hash, focus_area, model, prompt_version, output_digest, raw_output, "
+            "created_at) VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (image_hash, focus_area, model, prompt_version, output_digest) "
+            "DO UPDATE SET created_at = model_outputs.created_at RETURNING id",
+            (image.digest, image.focus_area, MODEL_NAME, result.prompt_version or prompt_version(image.focus_area),
+             _output_digest(raw_output), zlib.compress(raw_output.encode('utf-8')), now)
+        ).fetchone()[0]
+        self._save_parsed(output_id, parser_version, result.characteristics, result.confidence_score, now)
+        return output_id
+
+    def _save_parsed(self, output_id, parser_version, characteristics, confidence, now):
+        """Upsert a parse result; changed_at only moves when the characteristics differ. Returns whether they did"""
+        row = self._db.execute(
+            "SELECT characteristics FROM parsed_outputs WHERE output_id = ?", (output_id,)
+        ).fetchone()
+        changed = row is None or json.loads(row['characteristics']) != characteristics
+        self._db.execute(
+            "INSERT INTO parsed_outputs (output_id, parser_version, characteristics, confidence, changed_at) "
+            "VALUES (?, ?, ?, ?, ?) ON CONFLICT (output_id) DO UPDATE SET parser_version = excluded.parser_version, "
+            "characteristics = excluded.characteristics, confidence = excluded.confidence, "
+            "changed_at = CASE WHEN ? THEN excluded.changed_at ELSE changed_at END",
+            (output_id, parser_version, _dumps(characteristics), confidence, now, changed)
+        )
+        return changed
+
+    def get_analysis(self, analysis_id):
+        """Stored analysis with its per-image results, or None"""
+        with self._lock:
+            analysis = self._db.execute("SELECT * FROM analyses WHERE id = ?", (analysis_id,)).fetchone()
+            if analysis is None:
+                return None
+            images = self._db.execute(
+                "SELECT ai.image_name, o.image_hash, o.focus_area, o.model, o.prompt_version, p.characteristics, "
+                "p.confidence FROM analysis_images ai JOIN model_outputs o ON o.id = ai.output_id "
+                "JOIN parsed_outputs p ON p.output_id = ai.output_id WHERE ai.analysis_id = ? ORDER BY ai.position",
+                (analysis_id,)
+            ).fetchall()
+        return {
+            'analysis_id': analysis['id'],
+            'kind': analysis['kind'],
+            'created_at': analysis['created_at'],
+            'consolidated_characteristics': json.loads(analysis['consolidated']),
+            'overall_confidence': analysis['overall_confidence'],
+            'price_estimation': json.loads(analysis['price']),
+            'images': [
+                {
+                    'image_name': row['image_name'],
+                    'image_hash': row['image_hash'],
+                    'focus_area': row['focus_area'],
+                    'model': row['model'],
+                    'prompt_version': row['prompt_version'],
+                    'characteristics': json.loads(row['characteristics']),
+                    'confidence_score': row['confidence']
+                }
+                for row in images
+            ]
+        }
+
+    def reprocess(self, force=False, batch_size=REPROCESS_BATCH_SIZE):
+        """Redo parsing, consolidation and pricing where the stored result is stale.
+
+        Only outputs parsed with an older parser are re-parsed, only analyses
+        whose consolidation rule changed or whose images now parse differently
+        are re-consolidated, and only those plus analyses priced with older
+        pricing tables are re-priced, in bulk. force redoes everything.
+        """
+        started = time.perf_counter()
+        with pinned_snapshot():  # one set of tables for the whole run, even if the config reloads meanwhile
+            versions = component_versions()
+            stats = {'versions': versions}
+            stats['outputs_reparsed'], stats['outputs_changed'] = self._reparse_outputs(
+                versions['parser'], force, batch_size
+            )
+            reprice_ids = set()
+            stats['analyses_reconsolidated'] = self._reconsolidate(
+                versions['consolidation'], force, batch_size, reprice_ids
+            )
+            stats['analyses_changed'] = len(reprice_ids)
+            stats['analyses_repriced'] = self._reprice(versions['pricing'], force, batch_size, reprice_ids)
+        stats['seconds'] = round(time.perf_counter() - started, 3)
+        return stats
+
+    def _reparse_outputs(self, parser_version, force, batch_size):
+        reparsed = changed = 0
+        last_id = 0
+        while True:
+            with self._lock:
+                rows = self._db.execute(
+                    "SELECT o.id, o.raw_output FROM model_outputs o LEFT JOIN parsed_outputs p ON p.output_id = o.id "
+                    "WHERE o.id > ? AND (? OR p.parser_version IS NOT ?) ORDER BY o.id LIMIT ?",
+                    (last_id, force, parser_version, batch_size)
+                ).fetchall()
+                if not rows:
+                    return reparsed, changed
+                now = time.time()
+                for row in rows:
+                    characteristics = utils.parse_model_output(zlib.decompress(row['raw_output']).decode('utf-8'))
+                    changed += self._save_parsed(
+                        row['id'], parser_version, characteristics, utils.calculate_confidence_score(characteristics), now
+                    )
+                self._db.commit()
+            reparsed += len(rows)
+            last_id = rows[-1]['id']
+
+    def _reconsolidate(self, consolidation_version, force, batch_size, changed_ids):
+        with self._lock:
+            stale_ids = [row[0] for row in self._db.execute(
+                "SELECT id FROM analyses WHERE ? OR consolidation_version != ? UNION "
+                "SELECT ai.analysis_id FROM analysis_images ai JOIN parsed_outputs p ON p.output_id = ai.output_id "
+                "JOIN analyses a ON a.id = ai.analysis_id WHERE p.changed_at > a.consolidated_at",
+                (force, consolidation_version)
+            ).fetchall()]
+
+        for start in range(0, len(stale_ids), batch_size):
+            batch = stale_ids[start:start + batch_size]
+            placeholders = ','.join('?' * len(batch))
+            with self._lock:
+                analyses = {row['id']: row for row in self._db.execute(
+                    f"SELECT id, kind, consolidated FROM analyses WHERE id IN ({placeholders})", batch
+                ).fetchall()}
+                results = {analysis_id: [] for analysis_id in batch}
+                for row in self._db.execute(
+                    "SELECT ai.analysis_id, ai.image_name, p.characteristics, p.confidence FROM analysis_images ai "
+                    f"JOIN parsed_outputs p ON p.output_id = ai.output_id WHERE ai.analysis_id IN ({placeholders}) "
+                    "ORDER BY ai.analysis_id, ai.position", batch
+                ):
+                    results[row['analysis_id']].append(ImageAnalysisResult(
+                        image_name=row['image_name'],
+                        characteristics=json.loads(row['characteristics']),
+                        confidence_score=row['confidence'],
+                        analysis_notes=''
+                    ))
+
+                now = time.time()
+                for analysis_id in batch:
+                    individual = results[analysis_id]
+                    if analyses[analysis_id]['kind'] == 'single':
+                        consolidated, confidence = individual[0].characteristics, individual[0].confidence_score
+                    else:
+                        consolidated, confidence = analyzer.consolidate_multiple_analyses(individual)
+                    if consolidated != json.loads(analyses[analysis_id]['consolidated']):
+                        changed_ids.add(analysis_id)
+                    self._db.execute(
+                        "UPDATE analyses SET consolidated = ?, overall_confidence = ?, consolidation_version = ?, "
+                        "consolidated_at = ? WHERE id = ?",
+                        (_dumps(consolidated), confidence, consolidation_version, now, analysis_id)
+                    )
+                self._db.commit()
+        return len(stale_ids)
+
+    def _reprice(self, pricing_version, force, batch_size, changed_ids):
+        with self._lock:
+            stale_ids = {row[0] for row in self._db.execute(
+                "SELECT id FROM analyses WHERE ? OR pricing_version != ?", (force, pricing_version)
+            ).fetchall()}
+        stale_ids = sorted(stale_ids | changed_ids)
+
+        for start in range(0, len(stale_ids), batch_size):
+            batch = stale_ids[start:start + batch_size]
+            with self._lock:
+                rows = self._db.execute(
+                    f"SELECT id, consolidated FROM analyses WHERE id IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                prices = estimate_prices_bulk([json.loads(row['consolidated']) for row in rows])
+                self._db.executemany(
+                    "UPDATE analyses SET price = ?, pricing_version = ? WHERE id = ?",
+                    [(_dumps(price), pricing_version, row['id']) for row, price in zip(rows, prices)]
+                )
+                self._db.commit()
+        return len(stale_ids)
+
+    def stats(self):
+        """Row counts of the store and the state of the background writer"""
+        with self._lock:
+            counts = {
+                'model_outputs': self._db.execute("SELECT COUNT(*) FROM model_outputs").fetchone()[0],
+                'analyses': self._db.execute("SELECT COUNT(*) FROM analyses").fetchone()[0]
+            }
+        return {**counts, **writer_stats()}
+
+analysis_store = AnalysisStore() if ANALYSIS_STORE_PATH else None
+
+# Analyses are written by one background thread, in order, so requests never wait on the disk
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='analysis-store')
+_pending_writes = {}  # analysis id -> Future of its write
+_writer_stats = {'written': 0, 'failed': 0, 'last_error': None}
+
+def _write_done(analysis_id, future):
+    _pending_writes.pop(analysis_id, None)
+    error = future.exception()
+    if error is None:
+        _writer_stats['written'] += 1
+    else:
+        _writer_stats['failed'] += 1
+        _writer_stats['last_error'] = str(error)
+
+def record_analysis(kind, images, results, consolidated_characteristics, price_estimation):
+    """Queue an analysis for the store when it is enabled, returns its id (None when disabled) right away.
+
+    The write runs in the request's context, so it records the config
+    snapshot the request was served with.
+    """
+    if analysis_store is None:
+        return None
+    analysis_id = uuid.uuid4().hex
+    overall_confidence = statistics.mean(result.confidence_score for result in results)
+    future = _writer.submit(
+        contextvars.copy_context().run, analysis_store.record_analysis,
+        kind, images, results, consolidated_characteristics, overall_confidence, price_estimation, analysis_id
+    )
+    _pending_writes[analysis_id] = future
+    future.add_done_callback(lambda done: _write_done(analysis_id, done))
+    return analysis_id
+
+async def load_analysis(analysis_id):
+    """Stored analysis or None, waiting for its write when it is still queued"""
+    if analysis_store is None:
+        return None
+    pending = _pending_writes.get(analysis_id)
+    if pending is not None:
+        await asyncio.gather(asyncio.wrap_future(pending), return_exceptions=True)
+    return await asyncio.to_thread(analysis_store.get_analysis, analysis_id)
+
+def flush_writes():
+    """Wait for queued analyses to be written, e.g. at shutdown"""
+    _writer.submit(lambda: None).result()
+
+def writer_stats():
+    return {'pending_writes': len(_pending_writes), **_writer_stats}
@@ -0,0 +1,117 @@
+import hashlib
+from collections import namedtuple
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from config import MAX_FILE_SIZE, MAX_REQUEST_UPLOAD_SIZE, MAX_REQUEST_BODY_OVERHEAD, UPLOAD_CHUNK_SIZE
+
+UploadedImage = namedtuple('UploadedImage', ['data', 'name', 'focus_area', 'digest'])
+
+class UploadTooLargeError(Exception):
+    """Raised when an upload exceeds the per-image or per-request size limit"""
+
+class UploadBudget:
+    """Tracks bytes buffered for one request against MAX_REQUEST_UPLOAD_SIZE"""
+
+    def __init__(self, max_bytes=MAX_REQUEST_UPLOAD_SIZE):
+        self.max_bytes = max_bytes
+        self.used = 0
+
+    def consume(self, size):
+        self.used += size
+        if self.used > self.max_bytes:
+            raise UploadTooLargeError(f"Upload exceeds the {format_size(self.max_bytes)} per-request limit")
+
+_stats = {'requests': 0, 'bytes_read': 0, 'peak_request_bytes': 0, 'rejected': 0, 'known_images': 0}
+
+def format_size(size):
+    """Human readable size in MB"""
+    return f"{size / (1024 * 1024):g}MB"
+
+async def read_upload(file, budget=None, max_bytes=MAX_FILE_SIZE, chunk_size=UPLOAD_CHUNK_SIZE):
+    """Read an UploadFile in chunks, enforcing size limits as it goes.
+
+    Returns the raw bytes and their sha256 digest, computed while reading so
+    the cache never has to hash the image again. The bytes are a bytearray
+    allocated at the part's size up front and filled in place, so only one
+    copy of the image is held.
+    """
+    if file.size is not None and file.size > max_bytes:
+        _stats['rejected'] += 1
+        raise UploadTooLargeError(f"File {file.filename} exceeds the {format_size(max_bytes)} limit")
+
+    data = bytearray(file.size or 0)
+    size = 0
+    digest = hashlib.sha256()
+    try:
+        while chunk := await file.read(chunk_size):
+            end = size + len(chunk)
+            if end > max_bytes:
+                raise UploadTooLargeError(f"File {file.filename} exceeds the {format_size(max_bytes)} limit")
+            if budget is not None:
+                budget.consume(len(chunk))
+            digest.update(chunk)
+            data[size:end] = chunk  # in place while within the allocation, grows past it
+            size = end
+    except UploadTooLargeError:
+        _stats['rejected'] += 1
+        raise
+
+    del data[size:]
+    _stats['bytes_read'] += size
+    return data, digest.hexdigest()
+
+class RequestSizeLimitMiddleware:
+    """Refuse request bodies over the upload limits before form parsing reads them.
+
+    The multipart parser receives the whole body and spools it to temporary
+    files before an endpoint runs, so read_upload alone notices too late.
+    A Content-Length over the limit is answered with 413 without reading the
+    body; otherwise the bytes received are counted, which also covers
+    chunked bodies. limits maps paths to their own limit (e.g. batch zips).
+    """
+
+    def __init__(self, app, limits=None, default_limit=MAX_REQUEST_UPLOAD_SIZE, overhead=MAX_REQUEST_BODY_OVERHEAD):
+        self.app = app
+        self.limits = limits or {}
+        self.default_limit = default_limit
+        self.overhead = overhead
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        limit = self.limits.get(scope['path'], self.default_limit)
+        detail = f"Request body exceeds the {format_size(limit)} upload limit"
+        max_body = limit + self.overhead
+        headers = dict(scope['headers'])
+        content_length = headers.get(b'content-length')
+        if content_length is not None and content_length.isdigit() and int(content_length) > max_body:
+            _stats['rejected'] += 1
+            return await JSONResponse({'detail': detail}, status_code=413)(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+                if received > max_body:
+                    _stats['rejected'] += 1
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+def record_request(budget):
+    """Record the bytes a finished request held in memory"""
+    _stats['requests'] += 1
+    _stats['peak_request_bytes'] = max(_stats['peak_request_bytes'], budget.used)
+
+def record_known_images(count):
+    """Count images the client named by hash instead of uploading"""
+    _stats['known_images'] += count
+
+def upload_stats():
+    """Upload counters, including the largest per-request buffer seen"""
+    return dict(_stats)
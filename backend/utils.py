@@ -1,6 +1,10 @@
+import json
 import re
-from collections import Counter
-from config import CHARACTERISTIC_PATTERNS
+from config import STRUCTURED_OUTPUT, STRUCTURED_SCHEMAS, STRUCTURED_TOKENS_PER_KEY, MODEL_KEEP_ALIVE
+from config_snapshot import current_snapshot
+
+# Bump when a change to parsing or confidence scoring should re-parse stored model outputs
+PARSER_VERSION = 1
 
 def determine_focus_area(filename, index):
     """Determine focus area based on filename or position"""
@@ -16,34 +20,108 @@ def determine_focus_area(filename, index):
     
     return focus_area
 
-def parse_characteristics(analysis_text):
-    """Parse characteristics from analysis text"""
-    characteristics = {}
+def analysis_prompt(focus_area):
+    """Prompt sent to the model for a focus area in the configured output mode"""
+    prompts = current_snapshot().prompts
+    return prompts.get(focus_area, prompts["general"])
+
+def model_chat_options(focus_area="general"):
+    """Extra ollama.chat arguments for the configured output mode and keep-alive.
+
+    The JSON answer is capped in proportion to the keys its schema asks for.
+    """
+    if not STRUCTURED_OUTPUT:
+        return {'keep_alive': MODEL_KEEP_ALIVE}
+    schema = STRUCTURED_SCHEMAS.get(focus_area, STRUCTURED_SCHEMAS["general"])
+    return {
+        'format': 'json',
+        'options': {'num_predict': len(schema) * STRUCTURED_TOKENS_PER_KEY},
+        'keep_alive': MODEL_KEEP_ALIVE
+    }
+
+def parse_model_output(analysis_text):
+    """Parse model output, reading JSON answers directly and free text with the label parser"""
+    stripped = analysis_text.strip()
+    if stripped.startswith('```'):
+        stripped = stripped.strip('`').removeprefix('json').strip()
+    if stripped.startswith('{'):
+        try:
+            data = json.loads(stripped)
+        except ValueError:
+            # Cut off at the token limit; the pairs before the cut are still good
+            data = salvage_json_pairs(stripped)
+        if isinstance(data, dict) and data:
+            return parse_structured_characteristics(data)
+    return parse_characteristics(analysis_text)
+
+# A complete "key": value pair, where value is a string, number, literal or flat list
+_JSON_PAIR = re.compile(
+    r'"((?:[^"\\]|\\.)+)"\s*:\s*("(?:[^"\\]|\\.)*"|-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?|true|false|null|\[[^\[\]{}]*\])'
+)
+
+def salvage_json_pairs(text):
+    """The complete key/value pairs of a truncated JSON object"""
+    data = {}
+    for match in _JSON_PAIR.finditer(text):
+        try:
+            data[json.loads(f'"{match.group(1)}"')] = json.loads(match.group(2))
+        except ValueError:
+            continue
+    return data
+
+def parse_structured_characteristics(data):
+    """Validate a JSON answer into the characteristics dict"""
+    characteristics = dict.fromkeys(current_snapshot().characteristic_patterns, "Not specified")
+    for key, value in data.items():
+        key = key.strip().lower().replace(' ', '_')
+        if key not in characteristics or value is None or isinstance(value, dict):
+            continue
+        if isinstance(value, list):
+            value = ', '.join(str(item) for item in value)
+        value = str(value).strip()
+        if value.lower() == 'unknown':
+            value = "Unknown"
+        if value:
+            characteristics[key] = value
+    return characteristics
+
+_NEXT_LINE = re.compile(r'\s*(.+)')
+
+def parse_characteristics(analysis_text, parser=None):
+    """Parse characteristics from analysis text in a single scan for labelled lines"""
+    parser = parser or current_snapshot().characteristic_parser
+    characteristics = dict.fromkeys(parser.groupindex, "Not specified")
+    found = set()
     
-    for key, pattern in CHARACTERISTIC_PATTERNS.items():
-        match = re.search(pattern, analysis_text, re.IGNORECASE)
-        if match:
-            characteristics[key] = match.group(1).strip()
-        else:
-            characteristics[key] = "Not specified"
+    for match in parser.finditer(analysis_text):
+        key = match.lastgroup
+        if key in found:
+            continue
+        value = clean_characteristic_value(analysis_text[match.end(key):match.end()])
+        if not value:
+            # The value is on the following line, unless that line is another label
+            next_line = _NEXT_LINE.match(analysis_text, match.end())
+            if next_line is None:
+                continue
+            line_start = analysis_text.rfind('\n', 0, next_line.start(1)) + 1
+            if parser.match(analysis_text, line_start):
+                continue
+            value = clean_characteristic_value(next_line.group(1))
+        characteristics[key] = value
+        found.add(key)
     
     return characteristics
 
+def clean_characteristic_value(value):
+    """Strip whitespace and markdown emphasis around a value"""
+    return value.strip().strip('*_').strip()
+
 def calculate_confidence_score(characteristics):
     """Calculate confidence score based on how many characteristics were identified"""
     identified = sum(1 for v in characteristics.values() if v not in ["Not specified", "Unknown", "Not visible", ""])
     total = len(characteristics)
     return min(identified / total, 1.0)
 
-def get_most_common_value(values):
-    """Get most common value from a list, or first if all unique"""
-    if not values:
-        return "Not determined"
-    try:
-        return Counter(values).most_common(1)[0][0]
-    except:
-        return values[0]
-
 def get_positive_factors(characteristics):
     """Get positive factors that increase price"""
     factors = []
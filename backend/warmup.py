@@ -0,0 +1,132 @@
+import asyncio
+import io
+import os
+import time
+from PIL import Image
+from config import MODEL_NAME, MODEL_KEEP_ALIVE, MODEL_WARMUP, WARMUP_RETRY_SECONDS
+from model_client import model_pool
+from scheduler import model_scheduler
+
+WARMUP_REQUEST_ID = 'warmup'
+
+def process_started_at():
+    """Wall-clock start of this process, from /proc where available"""
+    try:
+        with open('/proc/self/stat') as f:
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - uptime + start_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return time.time()
+
+def warmup_image():
+    """A tiny JPEG, so the warm-up call also runs the vision encoder"""
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64), (128, 128, 128)).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+class ModelWarmup:
+    """Preloads the model at startup and tracks when the API became ready.
+
+    The model is loaded with MODEL_KEEP_ALIVE so Ollama keeps it resident,
+    then a one-token inference on a tiny image warms the vision path. Both
+    go through the model scheduler, once per Ollama backend, and the API is
+    ready as soon as one backend is warm. While none is reachable the
+    warm-up is retried every WARMUP_RETRY_SECONDS and /ready answers 503.
+    """
+
+    def __init__(self, scheduler=model_scheduler, pool=model_pool, enabled=MODEL_WARMUP,
+                 retry_seconds=WARMUP_RETRY_SECONDS):
+        self.scheduler = scheduler
+        self.pool = pool
+        self.enabled = enabled
+        self.retry_seconds = retry_seconds
+        self.process_started_at = process_started_at()
+        self.status = 'starting'
+        self._task = None
+        self._stats = {
+            'attempts': 0, 'last_error': None, 'startup_seconds': None, 'model_load_seconds': None,
+            'warmup_inference_seconds': None, 'cold_start_seconds': None, 'time_to_ready_seconds': None,
+            'warm_backends': 0
+        }
+
+    @property
+    def ready(self):
+        return self.status == 'ready'
+
+    def start(self):
+        """Record startup time and warm the model up in the background"""
+        self._stats['startup_seconds'] = round(time.time() - self.process_started_at, 3)
+        if not self.enabled:
+            self._mark_ready()
+            return
+        self.status = 'warming'
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            self._stats['attempts'] += 1
+            try:
+                await self.warm_up()
+                self._mark_ready()
+                return
+            except Exception as e:
+                self._stats['last_error'] = str(e)
+                await asyncio.sleep(self.retry_seconds)
+
+    async def warm_up(self):
+        """Load and pin the model on every backend, then run a one-token inference on each"""
+        if self.scheduler.model_client == self.pool.chat:
+            targets = [{'backend': host} for host in self.pool.hosts()]
+        else:
+            targets = [{}]  # a single injected client
+        results = await asyncio.gather(*(self._warm_up_backend(target) for target in targets), return_exceptions=True)
+        timings = [result for result in results if not isinstance(result, Exception)]
+        if not timings:
+            raise results[0]
+        # The slowest warm backend, i.e. what the first customer request would otherwise have waited for
+        load_seconds, inference_seconds = max(timings, key=sum)
+        self._stats['model_load_seconds'] = round(load_seconds, 3)
+        self._stats['warmup_inference_seconds'] = round(inference_seconds, 3)
+        self._stats['cold_start_seconds'] = round(load_seconds + inference_seconds, 3)
+        self._stats['warm_backends'] = len(timings)
+
+    async def _warm_up_backend(self, target):
+        started = time.perf_counter()
+        await self.scheduler.submit(
+            WARMUP_REQUEST_ID, model=MODEL_NAME, messages=[], keep_alive=MODEL_KEEP_ALIVE, **target
+        )
+        loaded = time.perf_counter()
+        await self.scheduler.submit(
+            WARMUP_REQUEST_ID,
+            model=MODEL_NAME,
+            messages=[{'role': 'user', 'content': 'What is in this image?', 'images': [warmup_image()]}],
+            options={'num_predict': 1},
+            keep_alive=MODEL_KEEP_ALIVE,
+            **target
+        )
+        return loaded - started, time.perf_counter() - loaded
+
+    def _mark_ready(self):
+        self.status = 'ready'
+        self._stats['last_error'] = None
+        self._stats['time_to_ready_seconds'] = round(time.time() - self.process_started_at, 3)
+
+    def stats(self):
+        """Readiness state with startup, cold-start and time-to-ready timings"""
+        return {
+            'status': self.status,
+            'model': MODEL_NAME,
+            'keep_alive': MODEL_KEEP_ALIVE,
+            'warmup_enabled': self.enabled,
+            **self._stats
+        }
+
+model_warmup = ModelWarmup()
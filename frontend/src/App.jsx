@@ -4,6 +4,7 @@ import UploadSection from './components/UploadSection';
 import LoadingIndicator from './components/LoadingIndicator';
 import ResultsSection from './components/ResultsSection';
 import Footer from './components/Footer';
+import UploadPipeline from './utils/UploadPipeline';
 
 function App() {
   const [selectedFiles, setSelectedFiles] = useState([]);
@@ -11,6 +12,7 @@ function App() {
   const [showResults, setShowResults] = useState(false);
   const [analysisResult, setAnalysisResult] = useState(null);
   const [errorMessage, setErrorMessage] = useState('');
+  const [uploadProgress, setUploadProgress] = useState(null);
   
   const handleFiles = (files) => {
     // Validate files
@@ -56,6 +58,7 @@ function App() {
 
     setIsLoading(true);
     setShowResults(false);
+    setUploadProgress(null);
     
     try {
       // Determine the correct API URL
@@ -64,48 +67,21 @@ function App() {
                               window.location.port === '5500';
       
       const baseUrl = isLocalDevelopment ? 'http://localhost:8000' : '';
-      const endpoint = selectedFiles.length > 1 ? '/analyze-multiple' : '/analyze';
-      const apiUrl = baseUrl + endpoint;
 
-      console.log('Attempting to connect to:', apiUrl);
       console.log('Number of files:', selectedFiles.length);
 
-      let response;
-      
-      if (selectedFiles.length === 1) {
-        // Single image analysis
-        const formData = new FormData();
-        formData.append('file', selectedFiles[0]);
-        
-        response = await fetch(baseUrl + '/analyze', {
-          method: 'POST',
-          body: formData,
-          headers: {
-            'Accept': 'application/json'
-          }
-        });
-      } else {
-        // Multiple images analysis
-        const formData = new FormData();
-        selectedFiles.forEach((file) => {
-          formData.append('files', file);
-        });
-        
-        response = await fetch(baseUrl + '/analyze-multiple', {
-          method: 'POST',
-          body: formData,
-          headers: {
-            'Accept': 'application/json'
-          }
-        });
-      }
+      // Images are downscaled and hashed in the browser; ones the server already analyzed are not uploaded again
+      const { response, url: apiUrl } = await UploadPipeline.analyze(
+        baseUrl,
+        selectedFiles,
+        (progress) => setUploadProgress(prev => ({ ...prev, ...progress }))
+      );
 
       console.log('Response status:', response.status);
-      console.log('Response headers:', response.headers);
 
       if (!response.ok) {
         const errorData = await response.json().catch(() => ({}));
-        const errorMessage = errorData.detail || `Server error: ${response.status} ${response.statusText}`;
+        const errorMessage = errorData.detail?.message || errorData.detail || `Server error: ${response.status} ${response.statusText}`;
         
         if (response.status === 404) {
           throw new Error(`API endpoint not found. Make sure FastAPI server is running on port 8000. Tried: ${apiUrl}`);
@@ -167,7 +143,7 @@ function App() {
           />
         )}
 
-        {isLoading && <LoadingIndicator />}
+        {isLoading && <LoadingIndicator progress={uploadProgress} />}
 
         {showResults && analysisResult && (
           <ResultsSection 
@@ -1,13 +1,38 @@
 import React from 'react';
 
-const LoadingIndicator = () => {
+const formatProgress = (progress) => {
+  if (!progress) return null;
+  if (progress.stage === 'preparing') {
+    return { text: `Preparing images (${progress.done}/${progress.total})...`, ratio: progress.done / progress.total };
+  }
+  if (progress.stage === 'uploading' && progress.total) {
+    const megabytes = (progress.total / (1024 * 1024)).toFixed(1);
+    return { text: `Uploading ${megabytes}MB...`, ratio: progress.done / progress.total };
+  }
+  return null;
+};
+
+const LoadingIndicator = ({ progress }) => {
+  const current = formatProgress(progress);
+  const skipped = progress?.skipped || 0;
+
   return (
     <div className="loading" style={{ display: 'block' }}>
       <div className="loading-spinner"></div>
-      <div className="loading-text">Analyzing your car images with AI...</div>
+      <div className="loading-text">{current ? current.text : 'Analyzing your car images with AI...'}</div>
+      {current && (
+        <div className="upload-progress">
+          <div className="upload-progress-bar" style={{ width: `${Math.round(current.ratio * 100)}%` }}></div>
+        </div>
+      )}
+      {skipped > 0 && (
+        <div className="loading-subtext">
+          {skipped} image{skipped > 1 ? 's' : ''} already analyzed or duplicated, not uploaded again
+        </div>
+      )}
       <div className="loading-subtext">This may take 30-60 seconds per image</div>
     </div>
   );
 };
 
-export default LoadingIndicator;
\ No newline at end of file
+export default LoadingIndicator;
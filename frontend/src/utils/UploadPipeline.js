@@ -0,0 +1,188 @@
+// Client side of the upload: images are downscaled and hashed in Web Workers,
+// duplicates are dropped, images the server has already analyzed are sent as
+// hashes only, and the rest is uploaded with progress reporting.
+
+const MAX_EDGE = 672; // PREPROCESS_MAX_EDGE in backend/config.py
+const JPEG_QUALITY = 0.85; // PREPROCESS_JPEG_QUALITY
+const MAX_WORKERS = 4;
+
+const UploadPipeline = {
+  // Resize and hash files in a small worker pool; files fall back to the original when that fails
+  async prepareImages(files, onProgress = () => {}) {
+    const prepared = new Array(files.length);
+    let done = 0;
+    const finish = (index, image) => {
+      prepared[index] = image;
+      done += 1;
+      onProgress({ stage: 'preparing', done, total: files.length });
+    };
+
+    let workers = [];
+    try {
+      const size = Math.min(MAX_WORKERS, navigator.hardwareConcurrency || 2, files.length);
+      for (let i = 0; i < size; i++) {
+        workers.push(new Worker(new URL('./imagePrep.worker.js', import.meta.url)));
+      }
+    } catch (error) {
+      console.warn('Image preparation workers unavailable, uploading originals:', error);
+      workers.forEach((worker) => worker.terminate());
+      workers = [];
+    }
+
+    if (workers.length === 0) {
+      files.forEach((file, index) => finish(index, { name: file.name, blob: file, sha256: null }));
+      return prepared;
+    }
+
+    let next = 0;
+    const original = (index, reason) => {
+      const file = files[index];
+      console.warn(`Could not prepare ${file.name}, uploading the original:`, reason);
+      finish(index, { name: file.name, blob: file, sha256: null });
+    };
+    const runWorker = (worker) => new Promise((resolve) => {
+      const send = () => {
+        if (next >= files.length) {
+          worker.terminate();
+          resolve();
+          return;
+        }
+        const index = next++;
+        worker.onmessage = ({ data }) => {
+          if (data.error) {
+            original(index, data.error);
+          } else {
+            const file = files[index];
+            finish(index, { name: file.name, blob: new Blob([data.buffer], { type: data.type }), sha256: data.sha256 });
+          }
+          send();
+        };
+        worker.onmessageerror = () => {
+          original(index, 'the prepared image could not be received');
+          send();
+        };
+        // The script failed to load (bundling, CSP worker-src) or threw outside its handler;
+        // this worker will not answer again, so stop it and leave the rest to the others
+        worker.onerror = (event) => {
+          event.preventDefault();
+          original(index, event.message || 'image preparation worker failed');
+          worker.terminate();
+          resolve();
+        };
+        worker.postMessage({ id: index, file: files[index], maxEdge: MAX_EDGE, quality: JPEG_QUALITY });
+      };
+      send();
+    });
+
+    await Promise.all(workers.map(runWorker));
+    // Files no worker got to, when every worker failed
+    for (let index = next; index < files.length; index++) {
+      original(index, 'no image preparation worker left');
+    }
+    return prepared;
+  },
+
+  // Keep the first of images with identical content
+  dedupe(images) {
+    const seen = new Set();
+    return images.filter((image) => {
+      if (!image.sha256) return true;
+      if (seen.has(image.sha256)) return false;
+      seen.add(image.sha256);
+      return true;
+    });
+  },
+
+  // Hashes the server already has an analysis for; an empty set when the lookup fails.
+  // A single image goes to /analyze, which keys its result differently, so the lookup is told.
+  async lookupCached(baseUrl, images) {
+    const hashed = images
+      .map((image, index) => ({ sha256: image.sha256, filename: image.name, index }))
+      .filter((image) => image.sha256);
+    if (hashed.length === 0) return new Set();
+
+    try {
+      const response = await fetch(baseUrl + '/cache/lookup', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json', 'Accept': 'application/json' },
+        body: JSON.stringify({ images: hashed, single: images.length === 1 })
+      });
+      if (!response.ok) return new Set();
+      const { known } = await response.json();
+      return new Set(known);
+    } catch (error) {
+      console.warn('Cache lookup failed, uploading every image:', error);
+      return new Set();
+    }
+  },
+
+  // POST form data with XMLHttpRequest, which reports upload progress; resolves to a fetch-like response
+  upload(url, formData, onProgress = () => {}) {
+    return new Promise((resolve, reject) => {
+      const xhr = new XMLHttpRequest();
+      xhr.open('POST', url);
+      xhr.setRequestHeader('Accept', 'application/json');
+      xhr.upload.onprogress = (e) => {
+        if (e.lengthComputable) {
+          onProgress({ stage: 'uploading', done: e.loaded, total: e.total });
+        }
+      };
+      xhr.upload.onload = () => onProgress({ stage: 'analyzing' });
+      xhr.onload = () => resolve({
+        ok: xhr.status >= 200 && xhr.status < 300,
+        status: xhr.status,
+        statusText: xhr.statusText,
+        json: async () => JSON.parse(xhr.responseText)
+      });
+      xhr.onerror = () => reject(new Error('Failed to fetch: network error during upload'));
+      xhr.send(formData);
+    });
+  },
+
+  buildRequest(baseUrl, images, known) {
+    const formData = new FormData();
+    if (images.length === 1) {
+      const [image] = images;
+      if (known.has(image.sha256)) {
+        formData.append('known_image', JSON.stringify({ sha256: image.sha256, filename: image.name }));
+      } else {
+        formData.append('file', image.blob, image.name);
+      }
+      return { url: baseUrl + '/analyze', formData };
+    }
+
+    const knownImages = [];
+    images.forEach((image, index) => {
+      if (known.has(image.sha256)) {
+        knownImages.push({ sha256: image.sha256, filename: image.name, index });
+      } else {
+        formData.append('files', image.blob, image.name);
+      }
+    });
+    if (knownImages.length > 0) {
+      formData.append('known_images', JSON.stringify(knownImages));
+    }
+    return { url: baseUrl + '/analyze-multiple', formData };
+  },
+
+  // Prepare, dedupe, look up and upload the selected files; resolves to the analysis response
+  async analyze(baseUrl, files, onProgress = () => {}) {
+    const images = this.dedupe(await this.prepareImages(files, onProgress));
+    const known = await this.lookupCached(baseUrl, images);
+    onProgress({ stage: 'uploading', done: 0, total: 0, skipped: files.length - images.length + known.size });
+
+    let { url, formData } = this.buildRequest(baseUrl, images, known);
+    let response = await this.upload(url, formData, onProgress);
+
+    if (response.status === 409) {
+      // Some results left the server cache since the lookup; upload those images after all
+      const { detail } = await response.json().catch(() => ({}));
+      (detail?.missing || [...known]).forEach((sha256) => known.delete(sha256));
+      ({ url, formData } = this.buildRequest(baseUrl, images, known));
+      response = await this.upload(url, formData, onProgress);
+    }
+    return { response, url };
+  }
+};
+
+export default UploadPipeline;
@@ -0,0 +1,37 @@
+// Downscales, re-encodes and hashes one image off the main thread.
+// The output mirrors the backend preprocessing (JPEG, longest edge capped),
+// so the upload is small and the server has nothing left to shrink.
+
+const toHex = (buffer) =>
+  Array.from(new Uint8Array(buffer), (byte) => byte.toString(16).padStart(2, '0')).join('');
+
+const resize = async (file, maxEdge, quality) => {
+  const bitmap = await createImageBitmap(file, { imageOrientation: 'from-image' });
+  const scale = Math.min(1, maxEdge / Math.max(bitmap.width, bitmap.height));
+  const width = Math.round(bitmap.width * scale);
+  const height = Math.round(bitmap.height * scale);
+
+  const canvas = new OffscreenCanvas(width, height);
+  canvas.getContext('2d').drawImage(bitmap, 0, 0, width, height);
+  bitmap.close();
+  // Re-encoding also drops EXIF/GPS metadata
+  const blob = await canvas.convertToBlob({ type: 'image/jpeg', quality });
+
+  // A small, already compressed JPEG can grow when re-encoded; keep the original then
+  if (scale === 1 && file.type === 'image/jpeg' && file.size <= blob.size) {
+    return file;
+  }
+  return blob;
+};
+
+self.onmessage = async ({ data: { id, file, maxEdge, quality } }) => {
+  try {
+    const canResize = typeof OffscreenCanvas !== 'undefined' && typeof createImageBitmap !== 'undefined';
+    const image = canResize ? await resize(file, maxEdge, quality) : file;
+    const buffer = await image.arrayBuffer();
+    const sha256 = toHex(await crypto.subtle.digest('SHA-256', buffer));
+    self.postMessage({ id, buffer, type: image.type || file.type, sha256 }, [buffer]);
+  } catch (error) {
+    self.postMessage({ id, error: error.message || String(error) });
+  }
+};